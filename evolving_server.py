@@ -1,41 +1,47 @@
-import h5py
 from bokeh.plotting import curdoc
 from visualizer.evolvingboundary import EvolvingBoundaryVisualizer
 from visualizer.evolvingmpe import EvolvingMemoryMapVisualizer
 from visualizer.evolvingsensitivity import EvolvingSensitivityVisualizer
 from bokeh.models import ColumnDataSource
 from bokeh.layouts import column, row
-import json
 import sys
 import argparse
 import os
-from skimage import measure
+import numpy as np
 from bokeh.plotting import output_file, save
-
-def extract_boundary_lines(xx, yy, zz):
-    contours = measure.find_contours(zz, level=0.5)  # Assuming boundary at 0.5 probability
-    xs, ys = [], []
-    for contour in contours:
-        xs.append(xx[0, 0] + contour[:, 1] * (xx[0, -1] - xx[0, 0]) / zz.shape[1])
-        ys.append(yy[0, 0] + contour[:, 0] * (yy[-1, 0] - yy[0, 0]) / zz.shape[0])
-    return xs, ys
+from visualizer.session import session_args, load_run
+from visualizer.profiling import add_profile_args, start_profile, phase, finish_profile
+from visualizer.telemetry import add_telemetry_args, attach_telemetry
+from visualizer.runs import read_evolving_server
+from visualizer.bundle import is_bundle
 
 # Parse command-line arguments
 parser = argparse.ArgumentParser(description="Launch the Bokeh server with an HDF5 file, this plot is to display changes in model behavior over training step.")
 parser.add_argument("--file", type=str, required=True, help="Path to the HDF5 file")
 parser.add_argument("--output", type=str, required=False, help="If specified filename, while running on python not bokeh serve, the html will be saved in ./output")
-args = parser.parse_args()
+parser.add_argument("--raster", action="store_true", help="Draw the memory map as a per-step density raster, with markers only once zoomed in below --raster_threshold points")
+parser.add_argument("--no-raster", dest="raster", action="store_false", help="Always draw the memory map as individual markers")
+parser.add_argument("--raster_bins", type=int, default=128, help="Number of bins per axis of the density raster, 128 by default")
+parser.add_argument("--raster_threshold", type=int, default=5000, help="Largest number of points in view drawn as markers when --raster is set, 5000 by default")
+parser.add_argument("--raster_by_class", action="store_true", help="Bin each class into its own raster layer in the class colour")
+parser.add_argument("--no-raster_by_class", dest="raster_by_class", action="store_false", help="Bin all classes into a single raster layer")
+parser.add_argument("--webgl", action="store_true", help="Render scatter plots with the WebGL backend")
+parser.add_argument("--no-webgl", dest="webgl", action="store_false", help="Render scatter plots with the default canvas backend")
+add_profile_args(parser)
+add_telemetry_args(parser)
+args = session_args(parser)
+start_profile("evolving_server", args)
 
 # Load the HDF5 file
 h5_file = args.file
 
 # Check if the file has an .h5 extension
-if not h5_file.lower().endswith(".h5"):
+if not is_bundle(h5_file) and not h5_file.lower().endswith(".h5"):
     print(f"Error: The input file '{h5_file}' is not an HDF5 (.h5) file.")
     sys.exit(1)
 
 # Check if the file exists
-if not os.path.isfile(h5_file):
+if not (is_bundle(h5_file) or os.path.isfile(h5_file)):
     print(f"Error: The file '{h5_file}' does not exist.")
     sys.exit(1)
 
@@ -43,97 +49,70 @@ if args.output is not None:
     os.makedirs('./output', exist_ok=True)
     output_file(filename=f"./output/{args.output}.html", title="Static HTML file", mode="inline")
 
-with h5py.File(h5_file, "r") as f:
-    # Read config (if needed for any parameters, e.g., max_steps)
-    read = f["config"]["config_data"][()]
-    config_json = read.decode("utf-8")
-    config = json.loads(config_json)
-    total_steps = config.get("total_step")
-    log_step = config.get("log_step")
-    total_batch = config.get("total_batch")
-    total_epoch = config.get("epoch")
-    
-    # Read X_train and y_train from coord
-    X_train = f["coord"]["X_train"][:]
-    y_train = f["coord"]["y_train"][:]
-    ids = list(range(len(X_train)))
-
-    # Extract data from scores group
-    bpe_scores = [f[f"scores/step_{step}"]["bpe"][()] for step in range(total_steps)]
-    bls_scores = [f[f"scores/step_{step}"]["bls"][()] for step in range(total_steps)]
-    softmax_deviation = [f[f"scores/step_{step}"]["softmax_deviations"][()] for step in range(total_steps)]
-
-    # Extract decision boundary data
-    xx = [f[f"scores/step_{step}"]["decision_boundary"]["xx"][:] for step in range(total_steps)]
-    yy = [f[f"scores/step_{step}"]["decision_boundary"]["yy"][:] for step in range(total_steps)]
-    Z = [f[f"scores/step_{step}"]["decision_boundary"]["Z"][:] for step in range(total_steps)]
-
-    # Sensitivity scores (if part of the scores group)
-    sensitivity_scores = [f[f"scores/step_{step}"]["sensitivities"][:] for step in range(total_steps)]
-
 # Define colors and markers based on class
 colors = ["blue", "green"]
 marker = ["circle", "square"]
 
-
-xs = []
-ys = []
-for step in range(total_steps):
-    xx_step = xx[step]
-    yy_step = yy[step]
-    zz_step = Z[step]
-    
-    # Extract boundary for each step
-    boundary_x, boundary_y = extract_boundary_lines(xx_step, yy_step, zz_step)
-    xs.append(boundary_x)
-    ys.append(boundary_y)
-
-shared_resource = ColumnDataSource(data={
-    "step": list(range(total_steps)),
-    "bpe": bpe_scores,
-    "bls": bls_scores,
-    "sensitivities": sensitivity_scores,
-    "softmax_deviations": softmax_deviation,
-    "xs": xs,
-    "ys": ys,
-})
-
-# Prepare the shared sources
-shared_source = ColumnDataSource(data={
-    "id": ids,
-    "x": X_train[:, 0],  # First dimension of X_train
-    "y": X_train[:, 1],  # Second dimension of X_train
-    "class": y_train,  # Class labels
-    "color": [colors[cls] for cls in y_train],
-    "marker": [marker[cls] for cls in y_train],
-    "alpha": [1.0] * len(y_train),
-    "size": [6] * len(y_train),
-    "bpe": bpe_scores[0],
-    "bls": bls_scores[0],
-    "sensitivities": sensitivity_scores[0],
-    "softmax_deviations": softmax_deviation[0],
-})
+total_steps, log_step, total_batch, X_train, y_train, ids, bpe_scores, bls_scores, softmax_deviation, sensitivity_scores, xs, ys = load_run("evolving_server", h5_file, read_evolving_server)
+
+with phase("sources"):
+    shared_resource = ColumnDataSource(data={
+        "step": list(range(total_steps)),
+        "bpe": bpe_scores,
+        "bls": bls_scores,
+        "sensitivities": sensitivity_scores,
+        "softmax_deviations": softmax_deviation,
+        "xs": xs,
+        "ys": ys,
+    })
+
+    # Prepare the shared sources
+    shared_source = ColumnDataSource(data={
+        "id": ids,
+        "x": X_train[:, 0],  # First dimension of X_train
+        "y": X_train[:, 1],  # Second dimension of X_train
+        "class": y_train,  # Class labels
+        "color": [colors[cls] for cls in y_train],
+        "marker": [marker[cls] for cls in y_train],
+        "alpha": np.ones(len(y_train)),
+        "size": np.full(len(y_train), 6.0),
+        "bpe": bpe_scores[0],
+        "bls": bls_scores[0],
+        "sensitivities": sensitivity_scores[0],
+        "softmax_deviations": softmax_deviation[0],
+    })
 
 # Initialize visualizers
-sensitivityvisualizer = EvolvingSensitivityVisualizer(shared_source)
-memorymapvisualizer = EvolvingMemoryMapVisualizer(shared_source)
-boundaryvisualizer = EvolvingBoundaryVisualizer(
-    shared_source,
-    shared_resource,
-    log_step,
-    colors,
-    total_batch,
-    max_steps=total_steps - 1
-)
-
-# Layout
-boundary_layout = column(boundaryvisualizer.get_layout(), width=575, height=575)
-memory_layout = column(memorymapvisualizer.get_layout(), width=600)
-sensitivity_layout = column(sensitivityvisualizer.get_layout(), width=450)
-
-layout = row(boundary_layout, memory_layout, sensitivity_layout)
+with phase("plots"):
+    sensitivityvisualizer = EvolvingSensitivityVisualizer(shared_source, shared_resource=shared_resource, webgl=args.webgl)
+    memorymapvisualizer = EvolvingMemoryMapVisualizer(shared_source, shared_resource=shared_resource,
+        raster_bins=args.raster_bins if args.raster else None, raster_threshold=args.raster_threshold,
+        raster_by_class=args.raster_by_class, webgl=args.webgl
+    )
+    boundaryvisualizer = EvolvingBoundaryVisualizer(
+        shared_source,
+        shared_resource,
+        log_step,
+        colors,
+        total_batch,
+        max_steps=total_steps - 1,
+        webgl=args.webgl
+    )
+    sensitivityvisualizer.link_slider(boundaryvisualizer.step_slider)
+    memorymapvisualizer.link_slider(boundaryvisualizer.step_slider)
+
+    # Layout
+    boundary_layout = column(boundaryvisualizer.get_layout(), width=575, height=575)
+    memory_layout = column(memorymapvisualizer.get_layout(), width=600)
+    sensitivity_layout = column(sensitivityvisualizer.get_layout(), width=450)
+
+    layout = row(boundary_layout, memory_layout, sensitivity_layout)
 
 curdoc().add_root(layout)
+attach_telemetry(curdoc(), "evolving_server", args)
 
 if args.output is not None:
-    save(layout)
\ No newline at end of file
+    with phase("save"):
+        save(layout)
+
+finish_profile(curdoc())
@@ -0,0 +1,349 @@
+import argparse
+import json
+import os
+import pickle
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import h5py
+import numpy as np
+from bokeh.client import pull_session
+from bokeh.core.json_encoder import serialize_json
+from bokeh.models import ColumnDataSource, Select, Slider
+from visualizer.runs import READERS
+
+def write_config(f, config):
+    f.create_group("config").create_dataset("config_data", data=json.dumps(config).encode("utf-8"))
+
+def write_boundary(group, rng, grid=100):
+    xx, yy = np.meshgrid(np.linspace(-3, 3, grid), np.linspace(-3, 3, grid))
+    boundary = group.create_group("decision_boundary")
+    boundary["xx"] = xx
+    boundary["yy"] = yy
+    boundary["Z"] = (np.sin(xx * rng.uniform(0.5, 2)) + yy * rng.normal() > 0).astype(np.float32)
+
+def write_synthetic(app, directory, points, steps, seed=0):
+    # A run with the layout each app reads, random values, and steps checkpoints or epochs
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(points, 2)).astype(np.float32)
+    y = (X[:, 0] + 0.3 * rng.normal(size=points) > 0).astype(np.int64)
+    images = rng.random((points, 1, 28, 28)).astype(np.float32)
+    labels = rng.integers(0, 10, points)
+    path = os.path.join(directory, f"{app}.h5")
+
+    if app == "cifar_server":
+        # Batch files with random pixels stand in for CIFAR-10
+        batch_dir = os.path.join(directory, "cifar-10-batches-py")
+        os.makedirs(batch_dir, exist_ok=True)
+        for i, rows in enumerate(np.array_split(np.arange(points), 5)):
+            with open(os.path.join(batch_dir, f"data_batch_{i + 1}"), "wb") as fo:
+                pickle.dump({b"data": rng.integers(0, 256, (len(rows), 3072), dtype=np.uint8)}, fo)
+        path = os.path.join(directory, "cifar_server.npz")
+        np.savez(path, label_noise_all=rng.normal(size=(points, 10)), labels_all=labels)
+        return path
+
+    with h5py.File(path, "w") as f:
+        if app == "mpe_server":
+            write_config(f, {"input_size": 2, "nc": 2, "model": "small_mlp", "device": "cpu", "optimizer": "iblr",
+                             "optimizer_params": {"lr": 2.0, "hess_init": 0.9}, "max_epochs": 3,
+                             "loss_criterion": "CrossEntropyLoss", "n_retrain": points})
+            scores = f.create_group("scores")
+            scores["X_train"] = X
+            scores["y_train"] = y
+            for name in ("bpe", "bls"):
+                scores[name] = rng.random(points).astype(np.float32)
+            for name in ("sensitivities", "softmax_deviations"):
+                scores[name] = rng.random(points)
+            scores["indices_retrain"] = np.arange(points)
+
+        elif app in ("evolving_server", "var_exp"):
+            write_config(f, {"total_step": steps, "log_step": 1, "total_batch": 4, "epoch": max(1, steps // 4)})
+            f["coord/X_train"] = X
+            f["coord/y_train"] = y
+            for step in range(steps):
+                group = f.create_group(f"scores/step_{step}")
+                for name in ("bpe", "bls", "softmax_deviations", "sensitivities", "average_marginal", "average_lambda"):
+                    group[name] = rng.random(points)
+                write_boundary(group, rng)
+
+        elif app in ("ls_server", "ls_step_server", "sigmoid_projection", "influence_server"):
+            # steps epochs of two batches each, the step apps read every batch
+            write_config(f, {"dataset": "toy", "max_epochs": steps, "total_batch": 2, "batch_size": points // 2})
+            f["coord/X_train"] = X
+            f["coord/y_train"] = y
+            for epoch in range(steps):
+                group = f.create_group(f"scores/epoch_{epoch}")
+                group["noise"] = rng.random(points)
+                group["sensitivities"] = rng.random(points)
+                write_boundary(group, rng)
+            for step in range(2 * steps):
+                group = f.create_group(f"scores/step_{step}")
+                group["noise"] = rng.random(points)
+                group["logits"] = rng.random(points)
+                group["sig_input"] = rng.normal(size=points)
+                group["param_update"] = rng.normal(size=(points, 8))
+                write_boundary(group, rng)
+
+        else:
+            write_config(f, {"dataset": "MNIST", "max_epochs": steps})
+            f["images"] = images
+            f["labels"] = labels
+            f["noise"] = rng.random(points)
+            f["bpe"] = rng.random(points).astype(np.float32)
+            f["bls"] = rng.random(points).astype(np.float32)
+            for epoch in range(steps):
+                group = f.create_group(f"scores/epoch_{epoch}")
+                for name in ("sensitivities", "bpe", "bls", "noise"):
+                    group[name] = rng.random(points)
+                group["all_noise"] = rng.normal(size=(points, 10))
+                results = f.create_group(f"results/epoch_{epoch}")
+                results["test_acc"] = rng.random()
+                results["test_nll"] = np.array(rng.random())
+                results["estimated_nll"] = rng.random()
+    return path
+
+def server_rss_mb(pid):
+    # Linux only, None elsewhere
+    try:
+        with open(f"/proc/{pid}/status") as fo:
+            for line in fo:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def read_messages(message_log):
+    # Changes received and sent by the server so far, logged by the app with --message_log
+    if not os.path.exists(message_log):
+        return []
+    with open(message_log) as fo:
+        return [json.loads(line) for line in fo if line.strip()]
+
+def handler_errors(log_file):
+    # A failing app still opens a session, with an empty document and the error only in the log
+    with open(log_file, errors="replace") as fo:
+        return [line.strip() for line in fo if "Error running application handler" in line]
+
+def wait_for_port(port, process, timeout=120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            return False
+        try:
+            with socket.create_connection(("localhost", port), timeout=1):
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+class LoadSession:
+    def __init__(self, url, seed):
+        self.url = url
+        self.rng = np.random.default_rng(seed)
+        self.session = None
+        self.open_seconds = None
+        self.document_bytes = 0
+        self.roundtrips = []
+        self.error = None
+
+    def open(self):
+        try:
+            start = time.perf_counter()
+            self.session = pull_session(url=self.url)
+            self.open_seconds = time.perf_counter() - start
+            self.document_bytes = len(serialize_json(self.session.document.to_json(deferred=False)))
+            if not self.session.document.roots:
+                self.error = "open: the app handler failed, the document is empty"
+        except Exception as e:
+            self.error = f"open: {e}"
+
+    def actions(self):
+        # Model changes the way an analyst makes them: slider steps, selections and class filters
+        doc = self.session.document
+        actions = []
+        for model in doc.models:
+            if isinstance(model, Slider) and model.end > model.start:
+                actions.append(lambda model=model: setattr(model, "value", self.slider_value(model)))
+            elif isinstance(model, Select) and len(model.options) > 1:
+                actions.append(lambda model=model: setattr(model, "value", self.option(model.options)))
+            elif isinstance(model, ColumnDataSource) and model.data:
+                n = len(next(iter(model.data.values())))
+                if n > 1:
+                    actions.append(lambda model=model, n=n: setattr(model.selected, "indices", sorted(self.rng.choice(n, size=self.rng.integers(1, min(n, 200) + 1), replace=False).tolist())))
+        return actions
+
+    def slider_value(self, slider):
+        # A position on the slider's own steps
+        positions = int((slider.end - slider.start) / slider.step) + 1
+        return min(slider.end, slider.start + slider.step * int(self.rng.integers(positions)))
+
+    def option(self, options):
+        option = options[self.rng.integers(len(options))]
+        return str(option[0]) if isinstance(option, (list, tuple)) else option
+
+    def run(self, n_actions, pause):
+        if self.session is None or self.error is not None:
+            return
+        try:
+            actions = self.actions()
+            for _ in range(n_actions if actions else 0):
+                # The change is sent as a patch, the round trip returns once the server applied it and ran
+                # its Python callbacks. The server logs the time spent on the change itself
+                start = time.perf_counter()
+                actions[self.rng.integers(len(actions))]()
+                self.session.force_roundtrip()
+                self.roundtrips.append(time.perf_counter() - start)
+                time.sleep(pause)
+        except Exception as e:
+            self.error = f"action: {e}"
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else float("nan")
+
+def run_level(url, n_sessions, n_actions, pause, pid, seed, log_file, message_log):
+    sessions = [LoadSession(url, seed + i) for i in range(n_sessions)]
+    known_errors = len(handler_errors(log_file))
+    rss_start = server_rss_mb(pid)
+    with ThreadPoolExecutor(max_workers=n_sessions) as pool:
+        list(pool.map(LoadSession.open, sessions))
+        rss_open = server_rss_mb(pid)
+        logged = len(read_messages(message_log))
+        list(pool.map(lambda session: session.run(n_actions, pause), sessions))
+    rss_actions = server_rss_mb(pid)
+    messages = read_messages(message_log)[logged:]
+    for session in sessions:
+        session.close()
+
+    opened = [session for session in sessions if session.open_seconds is not None]
+    open_seconds = [session.open_seconds for session in opened]
+    roundtrips = [roundtrip for session in sessions for roundtrip in session.roundtrips]
+    work = [message["ms"] for message in messages if message["direction"] == "received"]
+    sent = sum(message["bytes"] for message in messages if message["direction"] == "sent")
+    errors = [session.error for session in sessions if session.error is not None]
+    errors += [f"server: {line}" for line in handler_errors(log_file)[known_errors:]]
+    return {
+        "sessions": n_sessions,
+        "errors": errors,
+        "open_p50_s": percentile(open_seconds, 50),
+        "open_p95_s": percentile(open_seconds, 95),
+        "open_max_s": max(open_seconds, default=float("nan")),
+        "actions": len(roundtrips),
+        "roundtrip_p50_ms": percentile(roundtrips, 50) * 1000,
+        "roundtrip_p95_ms": percentile(roundtrips, 95) * 1000,
+        "server_p50_ms": percentile(work, 50),
+        "server_p95_ms": percentile(work, 95),
+        "server_max_ms": max(work, default=float("nan")),
+        "document_kb": np.mean([session.document_bytes for session in opened]) / 1024 if opened else float("nan"),
+        "sent_per_action_kb": sent / len(work) / 1024 if work else None,
+        "rss_start_mb": rss_start,
+        "rss_open_mb": rss_open,
+        "rss_actions_mb": rss_actions,
+        "rss_per_session_mb": (rss_open - rss_start) / n_sessions if rss_start is not None and rss_open is not None else None,
+    }
+
+# bokeh.client runs no JavaScript, so the changes only exercise the server side of an app
+NOTE = ("server: time the server spent applying each change, its Python callbacks included, as logged by the app "
+        "with --message_log. rt: round trip of each change seen by the client, it includes queueing behind other "
+        "sessions and a floor of about 40-90 ms from TCP delayed acknowledgements. sent: size of the changes the "
+        "server sent back per change. Slider, select and selection changes run no CustomJS under bokeh.client, so "
+        "apps whose interactions are browser callbacks are barely exercised by them, run the app with --telemetry "
+        "in a browser to time those.")
+
+def kb(value):
+    return "" if value is None else f"{value:.1f} KB"
+
+def print_report(app, first_session, levels):
+    print(f"\nLoad test of {app}, first session opened in {first_session:.2f}s")
+    print(f"{'sessions':>8} {'open p50':>9} {'open p95':>9} {'rt p50':>9} {'rt p95':>9} {'server p50':>10} {'server p95':>10} "
+          f"{'server max':>10} {'doc':>9} {'sent/act':>9} {'RSS':>9} {'RSS/sess':>9} {'errors':>6}")
+    for level in levels:
+        rss = "" if level["rss_actions_mb"] is None else f"{level['rss_actions_mb']:.0f} MB"
+        per_session = "" if level["rss_per_session_mb"] is None else f"{level['rss_per_session_mb']:.1f} MB"
+        print(f"{level['sessions']:>8} {level['open_p50_s']:>8.2f}s {level['open_p95_s']:>8.2f}s "
+              f"{level['roundtrip_p50_ms']:>7.1f}ms {level['roundtrip_p95_ms']:>7.1f}ms "
+              f"{level['server_p50_ms']:>8.1f}ms {level['server_p95_ms']:>8.1f}ms {level['server_max_ms']:>8.1f}ms "
+              f"{level['document_kb']:>6.0f} KB {kb(level['sent_per_action_kb']):>9} "
+              f"{rss:>9} {per_session:>9} {len(level['errors']):>6}")
+    print(NOTE)
+    for level in levels:
+        for error in sorted(set(level["errors"])):
+            print(f"Error with {level['sessions']} sessions: {error}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure how many simultaneous sessions one Bokeh server can host for a visualization: launches a local server, opens the sessions with bokeh.client and drives them with slider, selection and filter changes.")
+    parser.add_argument("--app", type=str, required=True, choices=list(READERS), metavar="APP", help="Visualization to load test, the name of its script")
+    parser.add_argument("--file", type=str, default=None, help="Run file or bundle to serve, a synthetic run is written when not specified")
+    parser.add_argument("--points", type=int, default=5000, help="Number of points of the synthetic run, 5000 by default")
+    parser.add_argument("--steps", type=int, default=20, help="Number of steps or epochs of the synthetic run, 20 by default")
+    parser.add_argument("--app_args", type=str, default="", help="Extra options of the app, given with an equals sign, e.g. --app_args=\"--raster --webgl\"")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 5, 10, 20], help="Numbers of simultaneous sessions to measure in turn, 1 5 10 20 by default")
+    parser.add_argument("--actions", type=int, default=20, help="Number of model changes made by each session, 20 by default")
+    parser.add_argument("--pause", type=float, default=0.1, help="Seconds between two changes of one session, 0.1 by default")
+    parser.add_argument("--port", type=int, default=5099, help="Port of the launched server, 5099 by default")
+    parser.add_argument("--report", type=str, default=None, help="If specified, the measurements are also written to this JSON file")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic run and of the changes, 0 by default")
+    args = parser.parse_args()
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    workdir = tempfile.mkdtemp(prefix="loadtest_")
+    app_args = shlex.split(args.app_args)
+    if args.file is None:
+        print(f"Writing a synthetic {args.app} run with {args.points} points and {args.steps} steps to '{workdir}'.")
+        run_file = write_synthetic(args.app, workdir, args.points, args.steps, args.seed)
+        if args.app == "cifar_server":
+            app_args += ["--cifar_root", workdir]
+    elif not os.path.exists(args.file):
+        print(f"Error: The file '{args.file}' does not exist.")
+        sys.exit(1)
+    else:
+        run_file = os.path.abspath(args.file)
+
+    # The app logs the size of every change it sends, bokeh.client drops the changes a server sends while
+    # it waits for a reply, so they cannot be measured on the client
+    log_file = os.path.join(workdir, "server.log")
+    message_log = os.path.join(workdir, "messages.jsonl")
+    command = [sys.executable, "-m", "bokeh", "serve", os.path.join(root, f"{args.app}.py"), "--port", str(args.port),
+               "--allow-websocket-origin", f"localhost:{args.port}", "--args", "--file", run_file,
+               "--message_log", message_log] + app_args
+    with open(log_file, "w") as log:
+        server = subprocess.Popen(command, cwd=workdir, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        if not wait_for_port(args.port, server):
+            print(f"Error: The server did not start, see '{log_file}'.")
+            sys.exit(1)
+
+        # The first session pays for the imports and the first read of the run, it is kept out of the levels
+        url = f"http://localhost:{args.port}/{args.app}"
+        first = LoadSession(url, args.seed)
+        first.open()
+        if first.error is not None:
+            print(f"Error: The first session could not be opened ({first.error}), see '{log_file}'.")
+            sys.exit(1)
+        first.close()
+
+        levels = []
+        for n_sessions in args.sessions:
+            print(f"Running {n_sessions} sessions ...")
+            levels.append(run_level(url, n_sessions, args.actions, args.pause, server.pid, args.seed, log_file, message_log))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print_report(args.app, first.open_seconds, levels)
+    if args.report is not None:
+        with open(args.report, "w") as fo:
+            json.dump({"app": args.app, "file": run_file, "app_args": app_args, "first_session_s": first.open_seconds,
+                       "note": NOTE, "levels": levels}, fo, indent=2)
+    print(f"Server log in '{log_file}'.")
+
+if __name__ == "__main__":
+    main()
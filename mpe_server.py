@@ -1,17 +1,20 @@
 import argparse
-import h5py
 from bokeh.plotting import curdoc
-import numpy as np
 
 from visualizer.decisionboundary import DecisionBoundaryVisualizer
 from visualizer.memorymap import MemoryMapVisualizer
 from visualizer.sensitivity import SensitivityVisualizer
+from visualizer.trainpool import get_pool
+from visualizer.session import session_args, load_run
+from visualizer.profiling import add_profile_args, start_profile, phase, finish_profile
+from visualizer.telemetry import add_telemetry_args, attach_telemetry
+from visualizer.runs import read_mpe_server
+from visualizer.bundle import is_bundle
 
 from bokeh.models import ColumnDataSource
 
 from bokeh.layouts import column, row
 
-import json
 import sys
 import os
 
@@ -19,66 +22,80 @@ import os
 # Parse command-line arguments
 parser = argparse.ArgumentParser(description="Launch the Bokeh server with an HDF5 file, this plot displays realtime how decision boundary changes with point perturbation alongside Memory Maps and Sensitivity plot.")
 parser.add_argument("--file", type=str, required=True, help="Path to the HDF5 file")
-args = parser.parse_args()
+parser.add_argument("--warm_start", action="store_true", help="Retrain from the full-data model instead of from scratch when points are removed")
+parser.add_argument("--no-warm_start", dest="warm_start", action="store_false", help="Retrain from scratch when points are removed")
+parser.add_argument("--warm_epochs", type=int, default=5, help="Number of epochs for a warm-start retrain, 5 by default")
+parser.add_argument("--warm_tol", type=float, default=None, help="If specified, stop a warm-start retrain early once the relative change in training loss falls below this value")
+parser.add_argument("--cache_size", type=int, default=32, help="Number of retrained decision boundaries to keep for repeated selections, 0 disables the cache")
+parser.add_argument("--preview", action="store_true", help="Draw a first-order estimate of the new decision boundary while the model retrains")
+parser.add_argument("--no-preview", dest="preview", action="store_false", help="Only draw the decision boundary once retraining finishes")
+parser.add_argument("--train_workers", type=int, default=1, help="Number of worker processes shared by all sessions for retraining, 0 retrains in a thread of each session instead")
+parser.add_argument("--train_threads", type=int, default=None, help="Number of torch threads per training worker, by default the CPU cores are split evenly between workers")
+parser.add_argument("--webgl", action="store_true", help="Render scatter plots with the WebGL backend")
+parser.add_argument("--no-webgl", dest="webgl", action="store_false", help="Render scatter plots with the default canvas backend")
+add_profile_args(parser)
+add_telemetry_args(parser)
+args = session_args(parser)
+start_profile("mpe_server", args)
 
 h5_file = args.file
 
 # Check if the file has an .h5 extension
 h5_file = args.file
-if not h5_file.lower().endswith(".h5"):
+if not is_bundle(h5_file) and not h5_file.lower().endswith(".h5"):
     print(f"Error: The input file '{h5_file}' is not an HDF5 (.h5) file.")
     sys.exit(1)
 
 # Check if the file exists
-if not os.path.isfile(h5_file):
+if not (is_bundle(h5_file) or os.path.isfile(h5_file)):
     print(f"Error: The file '{h5_file}' does not exist.")
     sys.exit(1)
 
 # Load data from the HDF5 file
-with h5py.File(h5_file, "r") as f:
-    scores_group = f["scores"]
-    X = np.array(scores_group["X_train"], dtype=np.float32)
-    y = np.array(scores_group["y_train"], dtype=np.int64)
-    estimated_deviation = np.array(scores_group["sensitivities"], dtype=np.float64)
-    true_deviation = np.array(scores_group["softmax_deviations"], dtype=np.float64)
-    bpe = np.array(scores_group["bpe"], dtype=np.float32)
-    bls = np.array(scores_group["bls"], dtype=np.float32)
-
-    read = f["config"]["config_data"][()]
-    config_json = read.decode("utf-8")
-    config = json.loads(config_json)
-
-# Generate IDs
-ids = list(range(len(X)))
-
-colors = ["blue", "green"]
-marker = ["circle", "square"]
-
-shared_source = ColumnDataSource(data={
-    "id": ids,
-    "x": X[:, 0],
-    "y": X[:, 1],
-    "class": y,
-    "color": [colors[cls] for cls in y],
-    "marker": [marker[cls] for cls in y],
-    "estimated_deviation": estimated_deviation,
-    "true_deviation": true_deviation,
-    "bpe": bpe,
-    "bls": bls
-})
+X, y, estimated_deviation, true_deviation, bpe, bls, config = load_run("mpe_server", h5_file, read_mpe_server)
+
+with phase("sources"):
+    # Generate IDs
+    ids = list(range(len(X)))
+
+    colors = ["blue", "green"]
+    marker = ["circle", "square"]
+
+    shared_source = ColumnDataSource(data={
+        "id": ids,
+        "x": X[:, 0],
+        "y": X[:, 1],
+        "class": y,
+        "color": [colors[cls] for cls in y],
+        "marker": [marker[cls] for cls in y],
+        "estimated_deviation": estimated_deviation,
+        "true_deviation": true_deviation,
+        "bpe": bpe,
+        "bls": bls
+    })
+
+# The training pool is created by the first session and shared by all later ones
+pool = None
+if args.train_workers > 0:
+    threads = args.train_threads or max(1, (os.cpu_count() or 1) // args.train_workers)
+    pool = get_pool(workers=args.train_workers, threads=threads)
 
 # Create the visualizer instances
-decision_boundary_visualizer = DecisionBoundaryVisualizer(shared_source, config)
-memory_map_visualizer = MemoryMapVisualizer(shared_source, colors, decision_boundary_visualizer)
-sensitivity_visualizer = SensitivityVisualizer(shared_source)
+with phase("plots"):
+    decision_boundary_visualizer = DecisionBoundaryVisualizer(shared_source, config, warm_start=args.warm_start, warm_epochs=args.warm_epochs, warm_tol=args.warm_tol, cache_size=args.cache_size, preview=args.preview, pool=pool, run_file=h5_file, webgl=args.webgl)
+    memory_map_visualizer = MemoryMapVisualizer(shared_source, colors, decision_boundary_visualizer, webgl=args.webgl)
+    sensitivity_visualizer = SensitivityVisualizer(shared_source, webgl=args.webgl)
 
-# Create the layout with Memory Map on top left, Decision Boundary on bottom half, and Sensitivity on the right
-memory_map_layout = column(memory_map_visualizer.get_layout(), width=400)
-decision_boundary_layout = column(decision_boundary_visualizer.get_layout(), height=600)
-sensitivity_layout = column(sensitivity_visualizer.get_layout(), width=550)
+    # Create the layout with Memory Map on top left, Decision Boundary on bottom half, and Sensitivity on the right
+    memory_map_layout = column(memory_map_visualizer.get_layout(), width=400)
+    decision_boundary_layout = column(decision_boundary_visualizer.get_layout(), height=600)
+    sensitivity_layout = column(sensitivity_visualizer.get_layout(), width=550)
 
-# Combine the layouts in a row
-layout = row(memory_map_layout, decision_boundary_layout, sensitivity_layout)
+    # Combine the layouts in a row
+    layout = row(memory_map_layout, decision_boundary_layout, sensitivity_layout)
 
 # Add the combined layout to the Bokeh document
-curdoc().add_root(layout)
\ No newline at end of file
+curdoc().add_root(layout)
+attach_telemetry(curdoc(), "mpe_server", args)
+
+finish_profile(curdoc())
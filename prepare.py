@@ -0,0 +1,122 @@
+import argparse
+import os
+import sys
+import time
+from visualizer.bundle import (BUNDLE_VERSION, is_bundle, read_manifest, write_manifest, file_digest,
+                               write_stage, stage_is_fresh, unpack)
+from visualizer.runs import (READERS, noise_order, encode_images, image_to_base64, load_cifar10_images,
+                             epoch_ranks, normalize_induced_noise, generate_noise_barchart)
+
+# Apps whose reader extracts decision boundary contours, these are simplified with --contour_tolerance
+CONTOUR_APPS = ("evolving_server", "var_exp", "ls_server", "ls_step_server", "sigmoid_projection", "influence_server")
+
+def cifar_batches(root):
+    batch_dir = os.path.join(root, "cifar-10-batches-py")
+    return [os.path.join(batch_dir, f"data_batch_{i}") for i in range(1, 6)]
+
+def cifar_thumbnails(run, root):
+    order = noise_order(run[0])
+    images = load_cifar10_images(root)
+    return [image_to_base64(images[i]) for i in order]
+
+def plan_stages(args):
+    # Each stage is (name, input files, parameters, build), build gets the values of the run stage
+    if args.app in CONTOUR_APPS:
+        tolerance = args.contour_tolerance
+        stages = [("run", [args.file], {"tolerance": tolerance}, lambda run: READERS[args.app](args.file, tolerance))]
+    else:
+        stages = [("run", [args.file], {}, lambda run: READERS[args.app](args.file))]
+
+    if args.app == "label_server":
+        stages += [
+            ("ranks", [args.file], {}, lambda run: [noise_order(run[0])]),
+            ("thumbnails", [args.file], {}, lambda run: [encode_images(run[1][noise_order(run[0])], run[5])]),
+        ]
+    elif args.app == "cifar_server":
+        stages += [
+            ("ranks", [args.file], {}, lambda run: [noise_order(run[0])]),
+            ("thumbnails", [args.file] + cifar_batches(args.cifar_root), {}, lambda run: [cifar_thumbnails(run, args.cifar_root)]),
+        ]
+    elif args.app == "image_mm_server":
+        stages += [
+            ("thumbnails", [args.file], {}, lambda run: [encode_images(run[2], run[0])]),
+        ]
+    elif args.app == "label_noise_epoch":
+        stages += [
+            ("thumbnails", [args.file], {}, lambda run: [encode_images(run[2], run[0])]),
+            ("ranks", [args.file], {}, lambda run: [epoch_ranks(run[4])]),
+            ("barcharts", [args.file], {}, lambda run: [[[generate_noise_barchart(noise) for noise in epoch_noise]
+                                                         for epoch_noise in normalize_induced_noise(run[5])]]),
+        ]
+    return stages
+
+def main():
+    parser = argparse.ArgumentParser(description="Prepare a bundle from an HDF5 or npz file once, every server accepts the bundle directory as --file and memory maps it instead of reading and processing the file for each session.")
+    parser.add_argument("--app", type=str, required=True, choices=list(READERS), metavar="APP", help="Visualization the bundle is prepared for, the name of its script")
+    parser.add_argument("--file", type=str, required=True, help="Path to the HDF5 or npz file")
+    parser.add_argument("--out", type=str, default=None, help="Bundle directory, the file name without extension followed by .bundle by default")
+    parser.add_argument("--cifar_root", type=str, default="./data", help="Directory containing cifar-10-batches-py, used by cifar_server, ./data by default")
+    parser.add_argument("--contour_tolerance", type=float, default=0.5, help="Largest distance in grid cells a simplified decision boundary may move from the traced one, 0 keeps every contour point, 0.5 by default")
+    parser.add_argument("--force", action="store_true", help="Rebuild every stage even when its inputs are unchanged")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.file):
+        print(f"Error: The file '{args.file}' does not exist.")
+        sys.exit(1)
+
+    if args.app == "cifar_server" and not all(os.path.isfile(path) for path in cifar_batches(args.cifar_root)):
+        print(f"Error: '{args.cifar_root}' does not contain the CIFAR-10 python batches (cifar-10-batches-py).")
+        sys.exit(1)
+
+    out = args.out or os.path.splitext(args.file)[0] + ".bundle"
+    if os.path.exists(out) and not os.path.isdir(out):
+        print(f"Error: '{out}' exists and is not a directory.")
+        sys.exit(1)
+    if os.path.exists(out) and not is_bundle(out) and os.listdir(out):
+        print(f"Error: '{out}' exists and is not a bundle.")
+        sys.exit(1)
+    os.makedirs(out, exist_ok=True)
+
+    # A bundle of another app or version is rebuilt from scratch
+    previous = read_manifest(out)
+    if previous is None or previous["app"] != args.app or previous["version"] != BUNDLE_VERSION or args.force:
+        previous = {"inputs": [], "stages": {}}
+    previous_digests = {digest["path"]: digest for digest in previous["inputs"]}
+
+    stages = plan_stages(args)
+    digests = {}
+    for _, inputs, _, _ in stages:
+        for path in inputs:
+            real = os.path.realpath(path)
+            if real not in digests:
+                digests[real] = file_digest(path, previous_digests.get(real))
+
+    manifest = {"version": BUNDLE_VERSION, "app": args.app, "inputs": list(digests.values()), "stages": {}}
+    run = None
+    for stage, inputs, params, build in stages:
+        stage_inputs = [digests[os.path.realpath(path)] for path in inputs]
+        entry = previous["stages"].get(stage)
+        if stage_is_fresh(entry, stage_inputs, params):
+            manifest["stages"][stage] = entry
+            print(f"{stage}: up to date")
+            continue
+
+        if run is None and stage != "run":
+            # The run stage was kept, its values are read back from the bundle
+            run = tuple(unpack(spec, os.path.join(out, "run")) for spec in manifest["stages"]["run"]["values"])
+
+        start = time.perf_counter()
+        values = build(run)
+        if stage == "run":
+            run = values
+        manifest["stages"][stage] = write_stage(out, stage, values, stage_inputs, params)
+        print(f"{stage}: built in {time.perf_counter() - start:.1f}s")
+
+        # Stages not reached yet keep their old entries, so an interrupted run only rebuilds what is left
+        write_manifest(out, {**manifest, "stages": {**previous["stages"], **manifest["stages"]}})
+
+    write_manifest(out, manifest)
+    print(f"Bundle for {args.app} written to '{out}'.")
+
+if __name__ == "__main__":
+    main()
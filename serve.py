@@ -0,0 +1,53 @@
+import argparse
+import os
+import sys
+from bokeh.application import Application
+from bokeh.application.handlers import ScriptHandler
+from bokeh.server.server import Server
+from visualizer import session
+
+APPS = ["mpe_server", "evolving_server", "var_exp", "ls_server", "ls_step_server", "sigmoid_projection",
+        "influence_server", "label_server", "cifar_server", "image_mm_server", "label_noise_epoch"]
+
+class RunHandler(ScriptHandler):
+    def __init__(self, filename):
+        super().__init__(filename=filename)
+        self.name = os.path.splitext(os.path.basename(filename))[0]
+
+    def modify_document(self, doc):
+        # The scripts exit on bad arguments, which must only fail this session and not the server
+        try:
+            super().modify_document(doc)
+        except SystemExit:
+            raise RuntimeError(f"{self.name} could not be started with the arguments of this session") from None
+
+def main():
+    parser = argparse.ArgumentParser(description="Launch one Bokeh server hosting every visualization, the run file and options are given per session as URL arguments, e.g. /evolving_server?file=run.h5&webgl=1")
+    parser.add_argument("--port", type=int, default=5006, help="Port to listen on, 5006 by default")
+    parser.add_argument("--address", type=str, default=None, help="Address to listen on, all interfaces by default")
+    parser.add_argument("--allow_websocket_origin", type=str, action="append", default=None, help="Public hostname allowed to connect, may be given several times, localhost by default")
+    parser.add_argument("--data_dir", type=str, default=".", help="Directory the file argument is resolved against, files outside it are refused, the current directory by default")
+    parser.add_argument("--cache_size", type=int, default=8, help="Number of loaded runs kept in memory and shared between sessions, 0 disables the cache")
+    parser.add_argument("--apps", type=str, nargs="+", default=APPS, choices=APPS, metavar="APP", help="Visualizations to host, all of them by default")
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.data_dir):
+        print(f"Error: The directory '{args.data_dir}' does not exist.")
+        sys.exit(1)
+
+    session.configure(cache_size=args.cache_size, data_dir=args.data_dir)
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    applications = {f"/{name}": Application(RunHandler(os.path.join(root, f"{name}.py"))) for name in args.apps}
+
+    server = Server(applications, port=args.port, address=args.address,
+                    allow_websocket_origin=args.allow_websocket_origin or [f"localhost:{args.port}"])
+    server.start()
+
+    print(f"Serving {', '.join(args.apps)} on http://localhost:{args.port}/")
+    server.io_loop.start()
+
+# Worker processes of the training pool are spawned and import this module again, they must not
+# start another server
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import shutil
+import numpy as np
+
+# Bumped whenever the layout of a bundle or the content of a stage changes, older bundles are rebuilt
+BUNDLE_VERSION = 1
+MANIFEST = "manifest.json"
+
+def is_bundle(path):
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+def manifest_path(path):
+    return os.path.join(path, MANIFEST)
+
+def read_manifest(bundle_dir):
+    if not is_bundle(bundle_dir):
+        return None
+    with open(manifest_path(bundle_dir)) as fo:
+        return json.load(fo)
+
+def write_manifest(bundle_dir, manifest):
+    # Written last and replaced atomically, a bundle interrupted mid-build keeps its previous manifest
+    tmp = manifest_path(bundle_dir) + ".tmp"
+    with open(tmp, "w") as fo:
+        json.dump(manifest, fo, indent=2)
+    os.replace(tmp, manifest_path(bundle_dir))
+
+def file_digest(path, previous=None, chunk_bytes=16 * 2**20):
+    # The content hash is only recomputed when the size or mtime changed since the previous digest
+    stat = os.stat(path)
+    digest = {"path": os.path.realpath(path), "size": stat.st_size, "mtime": stat.st_mtime}
+    if previous is not None and all(previous.get(key) == digest[key] for key in ("path", "size", "mtime")):
+        digest["sha256"] = previous["sha256"]
+        return digest
+
+    sha = hashlib.sha256()
+    with open(path, "rb") as fo:
+        for block in iter(lambda: fo.read(chunk_bytes), b""):
+            sha.update(block)
+    digest["sha256"] = sha.hexdigest()
+    return digest
+
+def flatten_arrays(value, leaves):
+    # Nested lists of numeric arrays become one flat buffer, the tree keeps each leaf's offset and shape
+    if isinstance(value, (np.ndarray, np.generic)) and value.dtype != object:
+        leaves.append(np.asarray(value))
+        return {"offset": None, "shape": list(np.shape(value))}
+    if isinstance(value, (list, tuple)):
+        tree = [flatten_arrays(item, leaves) for item in value]
+        return None if any(node is None for node in tree) else tree
+    return None
+
+def pack(value, directory, name):
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        np.save(os.path.join(directory, f"{name}.npy"), value)
+        return {"kind": "array", "file": f"{name}.npy"}
+
+    if isinstance(value, (list, tuple)) and value:
+        # Strings, or one list of strings per row, are stored as utf-8 bytes with offsets
+        nested = not all(isinstance(item, str) for item in value)
+        rows = value if nested else [value]
+        if all(isinstance(row, (list, tuple)) and all(isinstance(item, str) for item in row) for row in rows):
+            encoded = [item.encode("utf-8") for row in rows for item in row]
+            np.save(os.path.join(directory, f"{name}.npy"), np.frombuffer(b"".join(encoded), dtype=np.uint8))
+            np.save(os.path.join(directory, f"{name}.offsets.npy"), np.cumsum([0] + [len(item) for item in encoded]))
+            return {"kind": "strings", "file": f"{name}.npy", "offsets": f"{name}.offsets.npy",
+                    "rows": [len(row) for row in rows] if nested else None}
+
+        leaves = []
+        tree = flatten_arrays(value, leaves)
+        if tree is not None and leaves:
+            offset = 0
+            def place(node):
+                nonlocal offset
+                if isinstance(node, dict):
+                    node["offset"] = offset
+                    offset += int(np.prod(node["shape"]))
+                else:
+                    for child in node:
+                        place(child)
+            place(tree)
+            flat = np.concatenate([leaf.ravel() for leaf in leaves]).astype(np.result_type(*leaves))
+            np.save(os.path.join(directory, f"{name}.npy"), flat)
+            return {"kind": "arrays", "file": f"{name}.npy", "tree": tree}
+
+        if all(isinstance(item, (int, float, np.integer, np.floating)) for item in value):
+            np.save(os.path.join(directory, f"{name}.npy"), np.asarray(value))
+            return {"kind": "array", "file": f"{name}.npy", "list": True}
+
+    return {"kind": "json", "value": value.item() if isinstance(value, np.generic) else value}
+
+def unpack(spec, directory):
+    kind = spec["kind"]
+    if kind == "json":
+        return spec["value"]
+
+    # Arrays are memory mapped read-only, pages are only read when a session touches them
+    array = np.load(os.path.join(directory, spec["file"]), mmap_mode="r")
+    if kind == "array":
+        return array.tolist() if spec.get("list") else array
+
+    if kind == "strings":
+        offsets = np.load(os.path.join(directory, spec["offsets"]))
+        data = array.tobytes()
+        items = [data[start:end].decode("utf-8") for start, end in zip(offsets[:-1], offsets[1:])]
+        if spec["rows"] is None:
+            return items
+        bounds = np.cumsum([0] + spec["rows"])
+        return [items[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    def build(node):
+        if isinstance(node, dict):
+            return array[node["offset"]:node["offset"] + int(np.prod(node["shape"]))].reshape(node["shape"])
+        return [build(child) for child in node]
+    return build(spec["tree"])
+
+def write_stage(bundle_dir, stage, values, inputs, params):
+    # Built next to the old stage and swapped in, so a failed build never leaves a partial stage
+    directory = os.path.join(bundle_dir, stage)
+    tmp = directory + ".tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    specs = [pack(value, tmp, str(i)) for i, value in enumerate(values)]
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(tmp, directory)
+    return {"version": BUNDLE_VERSION, "inputs": [digest["sha256"] for digest in inputs], "params": params, "values": specs}
+
+def stage_is_fresh(entry, inputs, params):
+    return (entry is not None and entry["version"] == BUNDLE_VERSION
+            and entry["inputs"] == [digest["sha256"] for digest in inputs] and entry["params"] == params)
+
+def read_stage(bundle_dir, app, stage):
+    manifest = read_manifest(bundle_dir)
+    if manifest["app"] != app:
+        raise ValueError(f"'{bundle_dir}' was prepared for {manifest['app']}, not {app}")
+    if manifest["version"] != BUNDLE_VERSION:
+        raise ValueError(f"'{bundle_dir}' was written by an older version of prepare.py, run it again")
+
+    entry = manifest["stages"].get(stage)
+    if entry is None:
+        return None
+
+    for digest in manifest["inputs"]:
+        if os.path.isfile(digest["path"]):
+            stat = os.stat(digest["path"])
+            if stat.st_size != digest["size"] or stat.st_mtime != digest["mtime"]:
+                print(f"Warning: '{digest['path']}' changed since '{bundle_dir}' was prepared, run prepare.py again.")
+
+    values = tuple(unpack(spec, os.path.join(bundle_dir, stage)) for spec in entry["values"])
+    return values if len(values) > 1 else values[0]
@@ -1,4 +1,4 @@
-from bokeh.plotting import figure
+from bokeh.plotting import figure, curdoc
 from bokeh.layouts import column
 from bokeh.models import Div, ColumnDataSource
 import numpy as np
@@ -7,6 +7,12 @@ import torch
 from torch.utils.data import TensorDataset
 from skimage import measure
 import sys
+import copy
+import hashlib
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 sys.path.append("../memory-perturbation")
 
@@ -17,9 +23,21 @@ from lib.utils import get_quick_loader
 from torch.utils.data import DataLoader
 from lib.models import get_model
 from ivon import IVON as IBLR
+from visualizer.profiling import timed
+from visualizer.session import load_derived
 
-class DecisionBoundaryVisualizer:
-    def __init__(self, shared_source, config):
+class BoundaryTrainer:
+    # Everything needed to retrain and draw a boundary without any Bokeh model, so it can be
+    # pickled into the training pool's worker processes
+    @timed
+    def __init__(self, X, y, config, warm_start=False, warm_epochs=5, warm_tol=None, coarse_step=16, chunk_size=65536):
+        self.X = X
+        self.y = y
+        self.warm_start = warm_start
+        self.warm_epochs = warm_epochs
+        self.warm_tol = warm_tol
+        self.base_state = None
+        self.base_optim_state = None
 
         self.input_size = config.get("input_size")
         self.nc = config.get("nc")
@@ -30,11 +48,227 @@ class DecisionBoundaryVisualizer:
         self.max_epochs = config.get("max_epochs")
         self.loss_criterion = config.get("loss_criterion")
         self.n_retrain = config.get("n_retrain")
+
+        # Boundary grid is evaluated coarse-to-fine, in batches of at most chunk_size points
+        self.coarse_step = coarse_step
+        self.chunk_size = chunk_size
+
+    def calculate_boundaries(self, X, y, snapshot=False):
+        print("Calculating boundaries...")
+        unique_classes = np.unique(y)
+        if len(unique_classes) < 2:
+            return None, None, None
+        else:
+
+            criterion = nn.CrossEntropyLoss().to(self.device)
+            ds_train = TensorDataset(torch.tensor(X, dtype=torch.float32), torch.tensor(y, dtype=torch.long))
+            trainloader = get_quick_loader(DataLoader(ds_train, batch_size=256, shuffle=False), device=self.device) # training
+
+            if self.warm_start and self.base_state is not None:
+                model = self.train_warm(criterion, trainloader, X, y)
+            else:
+                model = get_model(self.model_name, self.nc, self.input_size, self.device, 1)
+                optim = IBLR(model.parameters(), lr=self.optim_param['lr'], mc_samples=4, ess=self.n_retrain, weight_decay=1e-3,
+                                    beta1=0.9, beta2=0.99999, hess_init=self.optim_param['hess_init'])
+                scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optim, T_max=self.max_epochs)
+                model, _ = train_model(model, criterion, optim, scheduler, trainloader, self.max_epochs, self.n_retrain, None, self.device)
+
+                if snapshot:
+                    self.base_state = copy.deepcopy(model.state_dict())
+                    self.base_optim_state = copy.deepcopy(optim.state_dict())
+
+            model.eval()
+            
+            return self.evaluate_boundary(model)
+
+    def train_baseline(self):
+        # The full-data boundary with the model and optimizer state it came from, the snapshot that
+        # warm starts and previews begin from
+        xx, yy, zz = self.calculate_boundaries(self.X, self.y, snapshot=True)
+        lines = self.extract_boundary_lines(xx, yy, zz) if xx is not None else ([], [])
+        return lines, self.base_state, self.base_optim_state
+
+    def baseline_key(self):
+        return (self.model_name, self.input_size, self.nc, self.max_epochs, self.n_retrain,
+                tuple(sorted(self.optim_param.items())), self.coarse_step)
+
+    def evaluate_boundary(self, model):
+        x_min, x_max = self.X[:, 0].min() - 1, self.X[:, 0].max() + 1
+        y_min, y_max = self.X[:, 1].min() - 1, self.X[:, 1].max() + 1
+        xx, yy = np.meshgrid(np.arange(x_min, x_max, 0.01), 
+                             np.arange(y_min, y_max, 0.01))
+        zz = self.evaluate_grid(model, xx[0], yy[:, 0])
+
+        return xx, yy, zz
+
+    def preview_boundaries(self, removed):
+        # First-order estimate of the retrained model (the memory-perturbation equation): one
+        # Newton step away from the removed points' loss, using the diagonal precision
+        # ess * (hess + weight_decay) that IVON kept for the full-data fit
+        model = get_model(self.model_name, self.nc, self.input_size, self.device, 1)
+        model.load_state_dict(self.base_state)
+        model.eval()
+
+        X_removed = torch.tensor(self.X[removed], dtype=torch.float32).to(self.device)
+        y_removed = torch.tensor(np.asarray(self.y)[removed], dtype=torch.long).to(self.device)
+        params = list(model.parameters())
+        loss = nn.CrossEntropyLoss(reduction="sum")(model(X_removed), y_removed)
+        grads = torch.autograd.grad(loss, params)
+
+        group = self.base_optim_state["param_groups"][0]
+        precision = group["ess"] * (group["hess"].to(self.device) + group["weight_decay"])
+        with torch.no_grad():
+            offset = 0
+            for param, grad in zip(params, grads):
+                size = param.numel()
+                param += grad / precision[offset:offset + size].view_as(param)
+                offset += size
+
+        xx, yy, zz = self.evaluate_boundary(model)
+        return self.extract_boundary_lines(xx, yy, zz)
+
+    def predict_classes(self, model, points):
+        labels = []
+        with torch.no_grad():
+            for start in range(0, len(points), self.chunk_size):
+                chunk = torch.tensor(points[start:start + self.chunk_size], dtype=torch.float32).to(self.device)
+                labels.append(torch.argmax(model(chunk), dim=1).cpu().numpy())
+        return np.concatenate(labels)
+
+    def evaluate_grid(self, model, x_axis, y_axis):
+        # Only the corners of coarse cells are evaluated at first. Cells around a class change are
+        # split in four and the rest are filled with their corner class, so the number of forward
+        # passes follows the boundary length rather than the plot area.
+        step = 2 ** int(np.log2(max(self.coarse_step, 1)))
+        spacing = x_axis[1] - x_axis[0]
+        nx, ny = len(x_axis), len(y_axis)
+        mx, my = -(-(nx - 1) // step), -(-(ny - 1) // step)
+
+        # Padded to whole coarse cells so every level is a regular lattice of the fine grid
+        zz = np.zeros((my * step + 1, mx * step + 1), dtype=np.int16)
+        known = np.zeros(zz.shape, dtype=bool)
+
+        def evaluate(iy, ix):
+            flat = np.unique(iy * zz.shape[1] + ix)
+            flat = flat[~known.ravel()[flat]]
+            if len(flat):
+                iy, ix = np.divmod(flat, zz.shape[1])
+                points = np.column_stack([x_axis[0] + ix * spacing, y_axis[0] + iy * spacing])
+                zz[iy, ix] = self.predict_classes(model, points)
+                known[iy, ix] = True
+
+        refine = np.ones((my, mx), dtype=bool)
+        while True:
+            cy, cx = np.nonzero(refine)
+            evaluate(np.concatenate([cy, cy, cy + 1, cy + 1]) * step, np.concatenate([cx, cx + 1, cx, cx + 1]) * step)
+            if step == 1:
+                break
+
+            lattice = zz[::step, ::step]
+            changed = ((lattice[:-1, :-1] != lattice[:-1, 1:]) | (lattice[:-1, :-1] != lattice[1:, :-1]) |
+                       (lattice[:-1, :-1] != lattice[1:, 1:]))
+
+            # A boundary can enter and leave a cell through the same edge without changing its
+            # corners, so the neighbours of every cell with a class change are refined as well
+            padded = np.pad(changed, 1)
+            grown = np.zeros_like(changed)
+            for dy in range(3):
+                for dx in range(3):
+                    grown |= padded[dy:dy + changed.shape[0], dx:dx + changed.shape[1]]
+
+            for cy, cx in zip(*np.nonzero(refine & ~grown)):
+                block = (slice(cy * step, (cy + 1) * step + 1), slice(cx * step, (cx + 1) * step + 1))
+                zz[block] = np.where(known[block], zz[block], lattice[cy, cx])
+
+            step //= 2
+            refine = grown.repeat(2, axis=0).repeat(2, axis=1)
+
+        return zz[:ny, :nx]
+
+    def train_warm(self, criterion, trainloader, X, y):
+        # Removing a few points barely moves the solution, so continue from the full-data
+        # snapshot (weights and IVON state) with a short schedule on the kept points
+        model = get_model(self.model_name, self.nc, self.input_size, self.device, 1)
+        model.load_state_dict(self.base_state)
+        optim = IBLR(model.parameters(), lr=self.optim_param['lr'], mc_samples=4, ess=self.n_retrain, weight_decay=1e-3,
+                            beta1=0.9, beta2=0.99999, hess_init=self.optim_param['hess_init'])
+        optim.load_state_dict(copy.deepcopy(self.base_optim_state))
+
+        # The snapshot ends at the bottom of its cosine schedule, restart from the retrain lr
+        lr = self.optim_param.get('lr_retrain', self.optim_param['lr'])
+        for group in optim.param_groups:
+            group['lr'] = group['initial_lr'] = lr
+        scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optim, T_max=self.warm_epochs)
+
+        if self.warm_tol is None:
+            model, _ = train_model(model, criterion, optim, scheduler, trainloader, self.warm_epochs, self.n_retrain, None, self.device)
+            return model
+
+        # Optional early stop once the training loss on the kept points stops improving
+        X_train = torch.tensor(X, dtype=torch.float32).to(self.device)
+        y_train = torch.tensor(y, dtype=torch.long).to(self.device)
+        prev_loss = None
+        for epoch in range(self.warm_epochs):
+            model, _ = train_model(model, criterion, optim, scheduler, trainloader, 1, self.n_retrain, None, self.device)
+            model.eval()
+            with torch.no_grad():
+                loss = criterion(model(X_train), y_train).item()
+            model.train()
+
+            if prev_loss is not None and abs(prev_loss - loss) <= self.warm_tol * abs(prev_loss):
+                print(f"Warm start converged after {epoch + 1} epochs")
+                break
+            prev_loss = loss
+
+        return model
+
+    def extract_boundary_lines(self, xx, yy, zz):
+        contours = measure.find_contours(zz, level=0.5)
+        xs, ys = [], []
+        for contour in contours:
+            xs.append(xx[0, 0] + contour[:, 1] * (xx[0, -1] - xx[0, 0]) / zz.shape[1])
+            ys.append(yy[0, 0] + contour[:, 0] * (yy[-1, 0] - yy[0, 0]) / zz.shape[0])
+        return xs, ys
+
+    def retrain(self, X, y):
+        xx, yy, zz = self.calculate_boundaries(X, y)
+        if xx is None:
+            return [], []
+        return self.extract_boundary_lines(xx, yy, zz)
+
+class DecisionBoundaryVisualizer:
+    @timed
+    def __init__(self, shared_source, config, warm_start=False, warm_epochs=5, warm_tol=None, cache_size=32, coarse_step=16, chunk_size=65536,
+                 preview=False, pool=None, run_file=None, webgl=False):
+        self.webgl = webgl
+        self.preview = preview
         self.source = shared_source
 
+        # Retraining runs off the Bokeh event loop, in the server-wide training pool when one is
+        # given; only the latest request is ever drawn
+        self.doc = curdoc()
+        self.pool = pool
+        # Stable key of this session's jobs in the pool, unlike id(self) it is never reused
+        self.pool_key = uuid.uuid4().hex
+        self.executor = ThreadPoolExecutor(max_workers=1) if pool is None else None
+        self.pending = None
+        # The first-order preview only reads the snapshot, it gets its own thread next to the retrain
+        self.preview_executor = ThreadPoolExecutor(max_workers=1) if preview else None
+        self.preview_pending = None
+        self.generation = 0
+        self.status_note = ""
+        self.doc.on_session_destroyed(self.on_session_destroyed)
+
+        # Contours of previous retrains, keyed by kept-point mask and training config (LRU)
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
         self.X = np.column_stack([self.source.data[feature] for feature in self.source.data if feature in ['x', 'y']])
         self.y = self.source.data['class']
 
+        self.trainer = BoundaryTrainer(self.X, np.asarray(self.y), config, warm_start=warm_start, warm_epochs=warm_epochs,
+                                       warm_tol=warm_tol, coarse_step=coarse_step, chunk_size=chunk_size)
+
         self.classes = np.unique(self.y) 
         self.message_div = Div(text="", width=400, height=50, styles={"color": "red"})
 
@@ -47,69 +281,55 @@ class DecisionBoundaryVisualizer:
             tools="tap,box_select,box_zoom,reset",
             active_drag="box_select",
             x_range=(x_min, x_max), 
-            y_range=(y_min, y_max)
+            y_range=(y_min, y_max),
+            output_backend="webgl" if self.webgl else "canvas"
         )
 
         self.boundary_source = ColumnDataSource(data=dict(xs=[], ys=[]))
+        self.preview_source = ColumnDataSource(data=dict(xs=[], ys=[]))
 
         self.plot.scatter("x", "y", size=8, source=self.source, color="color", marker="marker")
         self.plot.multi_line(xs="xs", ys="ys", source=self.boundary_source, line_width=2, color="black")
+        self.plot.multi_line(xs="xs", ys="ys", source=self.preview_source, line_width=2, color="black", line_dash="dashed")
 
-        xx, yy, zz = self.calculate_boundaries(self.X, self.y)
-        self.update_boundary(xx, yy, zz)
-
-    def calculate_boundaries(self, X, y):
-        print("Calculating boundaries...")
-        unique_classes = np.unique(y)
-        if len(unique_classes) < 2:
-            self.message_div.text = "Error: At least two classes are required to fit the model."
-            return None, None, None
+        # The full-data model is trained once per run file and shared by every session reading it
+        if run_file is not None:
+            baseline = load_derived("decisionboundary:baseline", run_file, self.trainer.train_baseline, *self.trainer.baseline_key())
         else:
-
-            self.model = get_model(self.model_name, self.nc, self.input_size, self.device, 1)
-            optim = IBLR(self.model.parameters(), lr=self.optim_param['lr'], mc_samples=4, ess=self.n_retrain, weight_decay=1e-3,
-                                beta1=0.9, beta2=0.99999, hess_init=self.optim_param['hess_init'])
-            scheduler = torch.optim.lr_scheduler.CosineAnnealingLR(optim, T_max=self.max_epochs)
-
-            self.message_div.text = ""
-            criterion = nn.CrossEntropyLoss().to(self.device)
-            ds_train = TensorDataset(torch.tensor(X, dtype=torch.float32), torch.tensor(y, dtype=torch.long))
-            trainloader = get_quick_loader(DataLoader(ds_train, batch_size=256, shuffle=False), device=self.device) # training
-            self.model, _ = train_model(self.model, criterion, optim, scheduler, trainloader, self.max_epochs, self.n_retrain, None, self.device)
-            self.model.eval()
-            
-            x_min, x_max = self.X[:, 0].min() - 1, self.X[:, 0].max() + 1
-            y_min, y_max = self.X[:, 1].min() - 1, self.X[:, 1].max() + 1
-            xx, yy = np.meshgrid(np.arange(x_min, x_max, 0.01), 
-                                 np.arange(y_min, y_max, 0.01))
-            
-            grid = np.c_[xx.ravel(), yy.ravel()]
-            grid = torch.tensor(grid, dtype=torch.float32).to(self.device)
-            
-            with torch.no_grad():
-                logits = self.model(grid)
-            
-            probabilities = torch.softmax(logits, dim=1)
-            zz = torch.argmax(probabilities, dim=1)
-            zz = zz.cpu().numpy().reshape(xx.shape)
-            
-            return xx, yy, zz
-
-    def extract_boundary_lines(self, xx, yy, zz):
-        contours = measure.find_contours(zz, level=0.5)
-        xs, ys = [], []
-        for contour in contours:
-            xs.append(xx[0, 0] + contour[:, 1] * (xx[0, -1] - xx[0, 0]) / zz.shape[1])
-            ys.append(yy[0, 0] + contour[:, 0] * (yy[-1, 0] - yy[0, 0]) / zz.shape[0])
-        return xs, ys
+            baseline = self.trainer.train_baseline()
+        (xs, ys), self.trainer.base_state, self.trainer.base_optim_state = baseline
+        self.boundary_source.data = {"xs": xs, "ys": ys}
+        self.cache_put(self.cache_key(np.ones(len(self.y), dtype=bool)),
+                       (self.boundary_source.data["xs"], self.boundary_source.data["ys"]))
 
     def update_boundary(self, xx, yy, zz):
         if xx is not None and yy is not None and zz is not None:
-            xs, ys = self.extract_boundary_lines(xx, yy, zz)
+            xs, ys = self.trainer.extract_boundary_lines(xx, yy, zz)
             self.boundary_source.data = {"xs": xs, "ys": ys}
         else:
             self.boundary_source.data = {"xs": [], "ys": []}
 
+    def cache_key(self, mask):
+        trainer = self.trainer
+        config = trainer.baseline_key() + (trainer.warm_start, trainer.warm_epochs, trainer.warm_tol)
+        digest = hashlib.sha1(np.packbits(mask).tobytes())
+        digest.update(repr((len(mask), config)).encode())
+        return digest.hexdigest()
+
+    def cache_get(self, key):
+        if key not in self.cache:
+            return None
+        self.cache.move_to_end(key)
+        return self.cache[key]
+
+    def cache_put(self, key, result):
+        if self.cache_size <= 0:
+            return
+        self.cache[key] = result
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
     def update(self, attr, old, new):
         mask = np.array(self.source.data["color"]) != "grey"
         x_new = np.array(self.source.data["x"])[mask]
@@ -118,8 +338,106 @@ class DecisionBoundaryVisualizer:
         X_new = np.vstack((x_new, y_new)).T
         y_new = np.array(self.source.data["class"])[mask].flatten()
 
-        xx, yy, zz = self.calculate_boundaries(X_new, y_new)
-        self.update_boundary(xx, yy, zz)
+        # A new request supersedes the previous one: a queued job is dropped (the pool hands its
+        # place in line to the new one) and a running one is left to finish, but its result is
+        # discarded in apply_result
+        self.generation += 1
+        if self.pending is not None and self.pool is None:
+            self.pending.cancel()
+        if self.preview_pending is not None:
+            self.preview_pending.cancel()
+            self.preview_pending = None
+
+        if len(np.unique(y_new)) < 2:
+            self.message_div.text = "Error: At least two classes are required to fit the model."
+            self.update_boundary(None, None, None)
+            self.preview_source.data = {"xs": [], "ys": []}
+            return
+
+        # Repeated or reverted selections are redrawn without retraining
+        key = self.cache_key(mask)
+        cached = self.cache_get(key)
+        if cached is not None:
+            self.pending = None
+            xs, ys = cached
+            self.boundary_source.data = {"xs": xs, "ys": ys}
+            self.preview_source.data = {"xs": [], "ys": []}
+            self.message_div.text = ""
+            return
+
+        self.status_note = ""
+        if self.preview and self.trainer.base_state is not None and (~mask).any():
+            # Drawn dashed until the exact retrain replaces it
+            self.preview_pending = self.preview_executor.submit(self.trainer.preview_boundaries, ~mask)
+            self.preview_pending.add_done_callback(partial(self.schedule_preview, self.generation))
+            self.status_note = " (dashed: first-order estimate)"
+
+        if self.pool is None:
+            self.show_position(self.generation, 0)
+            self.pending = self.executor.submit(self.trainer.retrain, X_new, y_new)
+        else:
+            self.pending = self.pool.submit(self.pool_key, self.trainer.retrain, X_new, y_new,
+                                            on_position=partial(self.schedule_position, self.generation))
+        self.pending.add_done_callback(partial(self.schedule_result, self.generation, key))
+
+    def on_session_destroyed(self, session_context):
+        # Nothing is drawn for a closed session, its queued jobs are dropped so they do not hold up others
+        self.generation += 1
+        if self.pool is not None:
+            self.pool.remove(self.pool_key)
+        else:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        if self.preview_executor is not None:
+            self.preview_executor.shutdown(wait=False, cancel_futures=True)
+
+    def schedule_position(self, generation, position):
+        # Called from the pool's threads whenever this session's place in the queue changes
+        self.doc.add_next_tick_callback(partial(self.show_position, generation, position))
+
+    def show_position(self, generation, position):
+        if generation != self.generation:
+            return
+        if position > 0:
+            self.message_div.text = f"Queued for training (position {position}){self.status_note}"
+        else:
+            self.message_div.text = f"Training\u2026{self.status_note}"
+
+    def schedule_preview(self, generation, future):
+        if future.cancelled():
+            return
+        self.doc.add_next_tick_callback(partial(self.apply_preview, generation, future))
+
+    def apply_preview(self, generation, future):
+        # Too late once a newer request was made or the exact boundary is already drawn
+        if generation != self.generation or self.pending is None:
+            return
+        self.preview_pending = None
+        if future.exception() is None:
+            xs, ys = future.result()
+            self.preview_source.data = {"xs": xs, "ys": ys}
+
+    def schedule_result(self, generation, key, future):
+        # Called from a worker or pool thread; hand the result back to the document's event loop
+        if future.cancelled():
+            return
+        self.doc.add_next_tick_callback(partial(self.apply_result, generation, key, future))
+
+    def apply_result(self, generation, key, future):
+        if future.exception() is None:
+            self.cache_put(key, future.result())
+        if generation != self.generation:
+            return
+
+        self.pending = None
+        self.preview_source.data = {"xs": [], "ys": []}
+        error = future.exception()
+        if error is not None:
+            self.message_div.text = f"Error: Retraining failed ({error})."
+            return
+
+        xs, ys = future.result()
+        self.boundary_source.data = {"xs": xs, "ys": ys}
+        self.message_div.text = ""
 
     def get_layout(self):
         return column(self.plot, self.message_div)
\ No newline at end of file
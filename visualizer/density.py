@@ -0,0 +1,168 @@
+from bokeh.models import ColumnDataSource, CustomJS, LogColorMapper
+from bokeh.palettes import Category10, Viridis256
+from bokeh.plotting import curdoc
+import numpy as np
+import matplotlib
+from visualizer.profiling import timed
+
+class DensityRaster:
+    @timed
+    def __init__(self, plot, scatter, shared_resource, step_field="step", x="bls", y="bpe", labels=None, colors=None,
+                 bins=128, threshold=5000):
+        self.plot = plot
+        self.scatter = scatter
+        self.step_field = step_field
+        self.bins = bins
+        self.threshold = threshold
+
+        # One layer per class when labels are given, otherwise a single layer for all points
+        if labels is not None:
+            labels = np.asarray(labels)
+            self.classes, self.codes = np.unique(labels, return_inverse=True)
+            if colors is None:
+                colors = [Category10[10][i % 10] for i in range(len(self.classes))]
+        else:
+            self.classes, self.codes = np.array([None]), None
+        self.layers = [f"image_{i}" for i in range(len(self.classes))]
+
+        # Under a server only the current step's raster is in the document and the next one is pushed on
+        # a step change; static output has no server to ask, so it carries every step for the slider
+        self.rasters = self.build_rasters(shared_resource, x, y)
+        self.step_rows = {int(step): row for row, step in enumerate(self.rasters[self.step_field])}
+        self.served = curdoc().session_context is not None
+        self.raster_resource = None if self.served else ColumnDataSource(data=self.rasters)
+        self.raster_source = ColumnDataSource(data=self.step_data(0))
+
+        self.images = []
+        # Colour scale is shared by all steps and layers so densities stay comparable while playing
+        high = max(float(np.nanmax(self.rasters[layer])) for layer in self.layers)
+        for i, layer in enumerate(self.layers):
+            palette = Viridis256 if colors is None else self.fade_palette(colors[i])
+            mapper = LogColorMapper(palette=palette, low=1, high=max(high, 2), nan_color=(0, 0, 0, 0))
+            self.images.append(self.plot.image(image=layer, x="x", y="y", dw="dw", dh="dh", source=self.raster_source,
+                                               color_mapper=mapper, global_alpha=0.8 if colors is not None else 1.0))
+
+        self.setup_callbacks()
+
+    def fade_palette(self, color, n=64):
+        r, g, b = matplotlib.colors.to_rgb(color)
+        return [matplotlib.colors.rgb2hex((1 - t * (1 - r), 1 - t * (1 - g), 1 - t * (1 - b))) for t in np.linspace(0.15, 1, n)]
+
+    def build_rasters(self, shared_resource, x, y):
+        # Binned once per step in NumPy; each step then costs bins x bins per layer in the browser
+        # however many points it holds. Empty bins are NaN so they render transparent.
+        data = {"x": [], "y": [], "dw": [], "dh": [], self.step_field: list(shared_resource.data[self.step_field])}
+        for layer in self.layers:
+            data[layer] = []
+
+        n_layers = len(self.layers)
+        for xs, ys in zip(shared_resource.data[x], shared_resource.data[y]):
+            xs, ys = np.asarray(xs, dtype=np.float64), np.asarray(ys, dtype=np.float64)
+            x0, x1 = xs.min(), xs.max()
+            y0, y1 = ys.min(), ys.max()
+            dw, dh = (x1 - x0) or 1.0, (y1 - y0) or 1.0
+
+            ix = np.minimum(((xs - x0) / dw * self.bins).astype(np.int64), self.bins - 1)
+            iy = np.minimum(((ys - y0) / dh * self.bins).astype(np.int64), self.bins - 1)
+            flat = iy * self.bins + ix
+            if self.codes is not None:
+                flat = flat + self.codes * self.bins * self.bins
+            counts = np.bincount(flat, minlength=n_layers * self.bins * self.bins).astype(np.float32)
+            counts[counts == 0] = np.nan
+            counts = counts.reshape(n_layers, self.bins, self.bins)  # Rows are y bins, drawn bottom up
+
+            data["x"].append(x0)
+            data["y"].append(y0)
+            data["dw"].append(dw)
+            data["dh"].append(dh)
+            for layer, raster in zip(self.layers, counts):
+                data[layer].append(raster)
+
+        return data
+
+    def step_data(self, row):
+        return {name: values[row:row + 1] for name, values in self.rasters.items()}
+
+    def setup_callbacks(self):
+        # Points are only drawn once the window holds fewer than threshold of them, counted from the raster
+        self.switch_callback = CustomJS(args={"raster_source": self.raster_source,
+                                              "x_range": self.plot.x_range,
+                                              "y_range": self.plot.y_range,
+                                              "scatter": self.scatter,
+                                              "images": self.images,
+                                              "layers": self.layers,
+                                              "bins": self.bins,
+                                              "threshold": self.threshold},
+        code="""
+            var data = raster_source.data;
+            var x0 = data["x"][0], y0 = data["y"][0], dw = data["dw"][0], dh = data["dh"][0];
+
+            function bin_range(range, origin, width) {
+                var start = Math.min(range.start, range.end), end = Math.max(range.start, range.end);
+                if (!isFinite(start) || !isFinite(end)) {
+                    return [0, bins - 1];
+                }
+                var lo = Math.floor((start - origin) / width * bins), hi = Math.floor((end - origin) / width * bins);
+                return [Math.max(lo, 0), Math.min(hi, bins - 1)];
+            }
+            var cols = bin_range(x_range, x0, dw), rows = bin_range(y_range, y0, dh);
+
+            var count = 0;
+            for (var l = 0; l < layers.length; l++) {
+                var raster = data[layers[l]][0];
+                for (var r = rows[0]; r <= rows[1]; r++) {
+                    for (var c = cols[0]; c <= cols[1]; c++) {
+                        var value = raster[r * bins + c];
+                        if (value > 0) {
+                            count += value;
+                        }
+                    }
+                }
+            }
+
+            var show_points = count <= threshold;
+            if (scatter.visible !== show_points) {
+                scatter.visible = show_points;
+                images.forEach(function(image) { image.visible = !show_points; });
+            }
+        """)
+
+        for attr in ("start", "end"):
+            self.plot.x_range.js_on_change(attr, self.switch_callback)
+            self.plot.y_range.js_on_change(attr, self.switch_callback)
+        # A raster pushed by the server is counted again for the current window
+        self.raster_source.js_on_change("data", self.switch_callback)
+
+        # The full view of the first step decides what is drawn before any range change
+        total = sum(np.nansum(self.raster_source.data[layer][0]) for layer in self.layers)
+        self.scatter.visible = bool(total <= self.threshold)
+        for image in self.images:
+            image.visible = not self.scatter.visible
+
+    def link_slider(self, slider):
+        if self.served:
+            slider.on_change("value", self.on_step)
+            return
+
+        slider.js_on_change("value", CustomJS(args={"raster_resource": self.raster_resource,
+                                                    "raster_source": self.raster_source,
+                                                    "step_rows": {str(step): row for step, row in self.step_rows.items()},
+                                                    "switch_callback": self.switch_callback},
+        code="""
+            var resource = raster_resource.data;
+            var step_index = step_rows[String(cb_obj.value)];
+
+            if (step_index !== undefined) {
+                // Swapped in place so the raster is never synced back to the server
+                for (var name in raster_source.data) {
+                    raster_source.data[name] = [resource[name][step_index]];
+                }
+                raster_source.change.emit();
+                switch_callback.execute(cb_obj);
+            }
+        """))
+
+    def on_step(self, attr, old, new):
+        row = self.step_rows.get(int(new))
+        if row is not None:
+            self.raster_source.data = self.step_data(row)
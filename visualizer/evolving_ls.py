@@ -1,9 +1,13 @@
 from bokeh.models import ColumnDataSource, CustomJS, Div, HoverTool
 from bokeh.plotting import figure
 from bokeh.layouts import row
+from visualizer.gallery import SelectionGallery
+from visualizer.profiling import timed
 
 class EvolvingLabelNoisePlot:
-    def __init__(self, shared_source, plot_name, y_range, n_sample):
+    @timed
+    def __init__(self, shared_source, plot_name, y_range, n_sample, webgl=False):
+        self.webgl = webgl
         self.shared_source = shared_source
         self.plot_name = plot_name
         self.n_sample = n_sample
@@ -13,15 +17,14 @@ class EvolvingLabelNoisePlot:
 
         self.plot = self.create_plot()
 
-        self.image_display = Div(
-            text="<h3>Selected Images:</h3>", 
-            sizing_mode="stretch_width", height=500, 
-            stylesheets=[""" .scroll-box { overflow-y: auto; max-height: 500px; padding: 10px; } """], 
-            css_classes=["scroll-box"]
+        self.gallery = SelectionGallery(
+            self.shared_source,
+            '<img src="data:image/png;base64,{img}" width="64" height="64">'
+            '<img src="data:image/png;base64,{noise_chart}" width="150" height="100">',
+            fields=("img", "noise_chart"), per_row=3, item_width=220, row_height=104,
+            width=720, height=450, refresh_on_data=True
         )
 
-        self.setup_callbacks()
-
     def create_plot(self):
         p = figure(
             width=800, height=500,
@@ -30,7 +33,7 @@ class EvolvingLabelNoisePlot:
             title=f"{self.plot_name} Label Noise Distribution",
             x_axis_label="Sorted Sample By Noise", y_axis_label=r"Label Noise ||ε||₂",
             x_range=(0, self.n_sample),
-            y_range=(self.y_min, self.y_max))
+            y_range=(self.y_min, self.y_max), output_backend="webgl" if self.webgl else "canvas")
         
         p.title.text_font_size = "25px"
         p.title.align = 'center'
@@ -52,52 +55,5 @@ class EvolvingLabelNoisePlot:
 
         return p
     
-    def setup_callbacks(self):
-        callback_code = """
-            var indices = source.selected.indices;
-            var images = source.data["img"];
-            var labels = source.data["label"];
-            var noise_charts = source.data["noise_chart"];
-            var html = "";
-
-            if (indices.length === 0) {
-                html += "<h3>No selection made.</h3>";
-            } else {
-                // Selection exists: Show selected images
-                var groupedImages = {};
-                html += "<h3>Selected Images:</h3>";
-                
-                for (var i = 0; i < indices.length; i++) {
-                    var label = labels[indices[i]];
-                    var imgTag = "<img src='data:image/png;base64," + images[indices[i]] + "' width='64' height='64'>";
-                    var noiseChartTag = "<img src='data:image/png;base64," + noise_charts[indices[i]] + "' width='150' height='100'>";
-                    var wrappedTag = "<span style='display: inline-block; margin: 5px;'>" + imgTag + noiseChartTag + "</span>";
-
-                    if (!(label in groupedImages)) {
-                        groupedImages[label] = [];
-                    }
-                    groupedImages[label].push(wrappedTag);
-                }
-
-                var sortedLabels = Object.keys(groupedImages).sort();
-                sortedLabels.forEach(function(label) {
-                    html += "<div style='margin-bottom:10px; max-width: 100%;'><b>Label: " + label + "</b><br>";
-                    html += "<div style='display: flex; flex-wrap: wrap; gap: 5px;'>" + groupedImages[label].join("") + "</div></div>";
-                });
-            }
-
-            image_display.text = '<div class="scroll-box">' + html + '</div>';
-        """
-
-        self.shared_source.selected.js_on_change("indices", CustomJS(args={
-            "source": self.shared_source, 
-            "image_display": self.image_display
-        }, code=callback_code))
-
-        self.shared_source.js_on_change("data", CustomJS(args={
-            "source": self.shared_source, 
-            "image_display": self.image_display
-        }, code=callback_code))
-    
     def get_layout(self):
-        return row(self.plot, self.image_display)
\ No newline at end of file
+        return row(self.plot, self.gallery.get_layout())
\ No newline at end of file
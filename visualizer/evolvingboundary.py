@@ -3,9 +3,13 @@ from bokeh.layouts import column, row
 import numpy as np
 import matplotlib
 from bokeh.plotting import figure
+from visualizer.playback import PlaybackScheduler
+from visualizer.profiling import timed
 
 class EvolvingBoundaryVisualizer:
-    def __init__(self, shared_source, shared_resource, steps, colors, batches=4, max_steps=30, show_lambda=False):
+    @timed
+    def __init__(self, shared_source, shared_resource, steps, colors, batches=4, max_steps=30, show_lambda=False, webgl=False):
+        self.webgl = webgl
         self.source = shared_source
         self.shared_resource = shared_resource
         self.batches = batches
@@ -30,7 +34,8 @@ class EvolvingBoundaryVisualizer:
             x_range=(x_min, x_max),
             y_range=(y_min, y_max),
             tools="tap,box_select,box_zoom,reset,pan",
-            active_drag="box_select"
+            active_drag="box_select",
+            output_backend="webgl" if self.webgl else "canvas"
         )
 
         # Initialize boundary source with data from step 0
@@ -99,6 +104,8 @@ class EvolvingBoundaryVisualizer:
         self.is_playing = False  # Variable to track whether the animation is playing
         self.step_value = 0  # Track the current step
 
+        self.playback = PlaybackScheduler(self.step_slider, self.play_pause_button)
+
         self.setup_callbacks()
 
     def setup_callbacks(self):
@@ -142,27 +149,6 @@ class EvolvingBoundaryVisualizer:
             }
         """))
 
-        # Update play/pause button behavior
-        self.play_pause_button.js_on_click(CustomJS(args={"slider": self.step_slider, "button": self.play_pause_button}, code="""
-            var step = slider.value;
-            var is_playing = button.label == "Pause";  // Check if currently playing
-            
-            if (is_playing) {
-                button.label = "Play";  // Change to "Play" when pausing
-                clearTimeout(slider._timeout);
-            } else {
-                button.label = "Pause";  // Change to "Pause" when playing
-                function animate() {
-                    if (step < slider.end) {
-                        step += 1;
-                        slider.value = step;
-                        slider._timeout = setTimeout(animate, 100);
-                    }
-                }
-                animate();
-            }
-        """))
-
         self.reset_button.js_on_click(CustomJS(args={"slider": self.step_slider}, code="""
             slider.value = 0;
         """))
@@ -213,7 +199,7 @@ class EvolvingBoundaryVisualizer:
             self.plot,
             self.message_div,
             row(self.play_pause_button, self.reset_button, self.clear_button),
-            row(self.epoch_div, self.step_slider),
+            row(self.epoch_div, self.step_slider, self.playback.get_layout()),
             row(self.backward_step_button, self.forward_step_button),
             row(self.backward_epoch_button, self.forward_epoch_button),
             row(Div(text="Tracker Colors:"), *self.tracker_buttons)
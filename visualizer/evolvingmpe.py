@@ -1,12 +1,30 @@
 from bokeh.plotting import figure
 from bokeh.layouts import column
-from bokeh.models import HoverTool
+from bokeh.models import HoverTool, CDSView
+import numpy as np
+from visualizer.density import DensityRaster
+from visualizer.profiling import timed
 
 class EvolvingMemoryMapVisualizer:
-    def __init__(self, shared_source, lambda_var_plot=False):
+    @timed
+    def __init__(self, shared_source, lambda_var_plot=False, view=None, shared_resource=None, raster_bins=None,
+                 raster_threshold=5000, raster_by_class=False, webgl=False):
+        self.webgl = webgl
         self.shared_source = shared_source
+        self.view = view if view is not None else CDSView()
         self.plot = self.create_plot()
 
+        self.density = None
+        if raster_bins is not None and shared_resource is not None:
+            labels = colors = None
+            if raster_by_class:
+                labels = shared_source.data["class"]
+                # Each class keeps the colour its markers are drawn with
+                _, first = np.unique(labels, return_index=True)
+                colors = [shared_source.data["color"][i] for i in first]
+            self.density = DensityRaster(self.plot, self.scatter, shared_resource, "step", labels=labels, colors=colors,
+                                         bins=raster_bins, threshold=raster_threshold)
+
         if lambda_var_plot:
             hover = HoverTool()
             hover.tooltips = [
@@ -22,17 +40,22 @@ class EvolvingMemoryMapVisualizer:
                    width=600, height=600,
                    tools='tap,box_select, box_zoom, reset',
                    active_drag='box_select',
+                   output_backend="webgl" if self.webgl else "canvas"
                    )
         p.xaxis.axis_label = 'Bayesian Leverage Score'
         p.yaxis.axis_label = 'Bayesian Prediction Error'
 
         # Plot the memory map using the source
-        p.scatter(x='bls', y='bpe', color='color', marker='marker', alpha='alpha', size='size', source=self.shared_source)
+        self.scatter = p.scatter(x='bls', y='bpe', color='color', marker='marker', alpha='alpha', size='size', source=self.shared_source, view=self.view)
 
         p.x_range.only_visible = p.y_range.only_visible = True
 
         return p
 
+    def link_slider(self, slider):
+        if self.density is not None:
+            self.density.link_slider(slider)
+
     def get_plot(self):
         return self.plot
 
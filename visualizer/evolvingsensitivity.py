@@ -1,13 +1,20 @@
 from bokeh.plotting import figure
 from bokeh.layouts import column
 import numpy as np
-from bokeh.models import HoverTool
+from bokeh.models import HoverTool, CustomJS
+from visualizer.profiling import timed
 
 class EvolvingSensitivityVisualizer:
-    def __init__(self, shared_source, lambda_var_plot=False):
+    @timed
+    def __init__(self, shared_source, lambda_var_plot=False, shared_resource=None, webgl=False):
+        self.webgl = webgl
         self.shared_source = shared_source
+        self.shared_resource = shared_resource
         self.plot = self.create_plot()
 
+        if self.shared_resource is not None:
+            self.fit_steps()
+
         if lambda_var_plot:
             hover = HoverTool()
             hover.tooltips = [
@@ -21,7 +28,7 @@ class EvolvingSensitivityVisualizer:
         p = figure(title="Sensitivity Visualization",
                    width=600, height=600,
                    tools='tap,box_select, box_zoom,reset',
-                   active_drag='box_select')
+                   active_drag='box_select', output_backend="webgl" if self.webgl else "canvas")
         p.xaxis.axis_label = 'True Deviation'
         p.yaxis.axis_label = 'Estimated Deviation'
 
@@ -37,24 +44,43 @@ class EvolvingSensitivityVisualizer:
 
         return p
 
-    def update(self):
-        self.update_regression_line()
+    def fit_steps(self):
+        # Least-squares fit for every step at once, stored with the other per-step series so the
+        # slider can redraw the line in the browser
+        true_deviation = np.asarray(self.shared_resource.data['softmax_deviations'], dtype=np.float64)
+        estimated_deviation = np.asarray(self.shared_resource.data['sensitivities'], dtype=np.float64)
 
-    def update_regression_line(self):
-        # Extract data from the updated source
-        true_deviation = self.shared_source.data['softmax_deviations']
-        estimated_deviation = self.shared_source.data['sensitivities']
+        x_mean = true_deviation.mean(axis=1, keepdims=True)
+        y_mean = estimated_deviation.mean(axis=1, keepdims=True)
+        covariance = ((true_deviation - x_mean) * (estimated_deviation - y_mean)).sum(axis=1)
+        variance = ((true_deviation - x_mean) ** 2).sum(axis=1)
+        slope = np.divide(covariance, variance, out=np.zeros_like(covariance), where=variance > 0)
+        intercept = y_mean[:, 0] - slope * x_mean[:, 0]
 
-        if len(true_deviation) > 1:  # Ensure there's enough data for regression
-            # Calculate the linear regression coefficients
-            slope, intercept = np.polyfit(true_deviation, estimated_deviation, 1)
+        x_min, x_max = true_deviation.min(axis=1), true_deviation.max(axis=1)
+        self.shared_resource.data.update({
+            "fit_x0": x_min, "fit_x1": x_max,
+            "fit_y0": slope * x_min + intercept, "fit_y1": slope * x_max + intercept,
+        })
+        self.regression_line.data_source.data = {"x": [x_min[0], x_max[0]], "y": [slope[0] * x_min[0] + intercept[0], slope[0] * x_max[0] + intercept[0]]}
 
-            # Generate x and y values for the regression line
-            x_vals = np.linspace(min(true_deviation), max(true_deviation), 100)
-            y_vals = slope * x_vals + intercept
+    def link_slider(self, slider):
+        # Row of every step in the per-step series, looked up by the slider instead of searched
+        step_rows = {str(int(step)): row for row, step in enumerate(self.shared_resource.data["step"])}
+        slider.js_on_change("value", CustomJS(args={"shared_resource": self.shared_resource,
+                                                    "line_source": self.regression_line.data_source,
+                                                    "step_rows": step_rows},
+        code="""
+            var shared_data = shared_resource.data;
+            var step_index = step_rows[String(cb_obj.value)];
 
-            # Update the regression line data
-            self.regression_line.data_source.data = {"x": x_vals, "y": y_vals}
+            if (step_index !== undefined) {
+                // Swapped in place so the line is never synced back to the server
+                line_source.data["x"] = [shared_data["fit_x0"][step_index], shared_data["fit_x1"][step_index]];
+                line_source.data["y"] = [shared_data["fit_y0"][step_index], shared_data["fit_y1"][step_index]];
+                line_source.change.emit();
+            }
+        """))
 
     def get_plot(self):
         return self.plot
@@ -0,0 +1,106 @@
+from bokeh.models import ColumnDataSource, CustomJS, DataTable, TableColumn, HTMLTemplateFormatter, Div
+from bokeh.layouts import column
+from visualizer.profiling import timed
+
+class SelectionGallery:
+    @timed
+    def __init__(self, source, item_template, fields=("img",), per_row=10, item_width=60, row_height=60,
+                 width=500, height=600, label_field="label", refresh_on_data=False):
+        self.source = source
+        self.item_template = item_template
+        self.fields = list(fields)
+        self.per_row = per_row
+        self.label_field = label_field
+
+        # One gallery row holds up to per_row items of a single class. Cells only reference the
+        # strings already held by the shared source, and the DataTable (SlickGrid) only builds DOM
+        # for the rows inside the visible scroll window, so large selections stay cheap.
+        self.cell_columns = [[f"{field}_{j}" for field in self.fields] for j in range(self.per_row)]
+        data = {"label": []}
+        for names in self.cell_columns:
+            for name in names:
+                data[name] = []
+        self.gallery_source = ColumnDataSource(data=data)
+
+        self.summary = Div(text="<h3>No selection made.</h3>", width=width)
+
+        columns = [TableColumn(field="label", title="Class", width=50,
+                               formatter=HTMLTemplateFormatter(template="<b><%= value %></b>"))]
+        for j, names in enumerate(self.cell_columns):
+            cell = self.item_template.format(**{field: f"<%= {name} %>" for field, name in zip(self.fields, names)})
+            template = f"<% if ({names[0]}) {{ %>{cell}<% }} %>"
+            columns.append(TableColumn(field=names[0], title="", width=item_width,
+                                       formatter=HTMLTemplateFormatter(template=template)))
+
+        self.table = DataTable(
+            source=self.gallery_source, columns=columns,
+            width=width, height=height, row_height=row_height,
+            index_position=None, header_row=False,
+            selectable=False, sortable=False, reorderable=False
+        )
+
+        self.setup_callbacks(refresh_on_data)
+
+    def setup_callbacks(self, refresh_on_data):
+        callback = CustomJS(args={"source": self.source,
+                                  "gallery": self.gallery_source,
+                                  "summary": self.summary,
+                                  "fields": self.fields,
+                                  "cell_columns": self.cell_columns,
+                                  "label_field": self.label_field},
+        code="""
+            var indices = source.selected.indices;
+            var labels = source.data[label_field];
+            var per_row = cell_columns.length;
+
+            var grouped = {};
+            for (var i = 0; i < indices.length; i++) {
+                var label = String(labels[indices[i]]);
+                if (!(label in grouped)) {
+                    grouped[label] = [];
+                }
+                grouped[label].push(indices[i]);
+            }
+            var sorted_labels = Object.keys(grouped).sort((a, b) => a.localeCompare(b, undefined, {numeric: true}));
+
+            var rows = {label: []};
+            for (var j = 0; j < per_row; j++) {
+                for (var f = 0; f < fields.length; f++) {
+                    rows[cell_columns[j][f]] = [];
+                }
+            }
+
+            var counts = [];
+            sorted_labels.forEach(function(label) {
+                var members = grouped[label];
+                counts.push("<b>" + label + "</b>: " + members.length);
+                for (var k = 0; k < members.length; k += per_row) {
+                    rows["label"].push(label);
+                    for (var j = 0; j < per_row; j++) {
+                        var idx = k + j < members.length ? members[k + j] : -1;
+                        for (var f = 0; f < fields.length; f++) {
+                            rows[cell_columns[j][f]].push(idx === -1 ? "" : source.data[fields[f]][idx]);
+                        }
+                    }
+                }
+            });
+
+            // Columns are swapped in place so the gallery is never synced back to the server
+            for (var key in rows) {
+                gallery.data[key] = rows[key];
+            }
+            gallery.change.emit();
+
+            if (indices.length === 0) {
+                summary.text = "<h3>No selection made.</h3>";
+            } else {
+                summary.text = "<h3>Selected Images: " + indices.length + "</h3>" + counts.join(" &middot; ");
+            }
+        """)
+
+        self.source.selected.js_on_change("indices", callback)
+        if refresh_on_data:
+            self.source.js_on_change("data", callback)
+
+    def get_layout(self):
+        return column(self.summary, self.table)
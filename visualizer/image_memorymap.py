@@ -3,9 +3,16 @@ from bokeh.layouts import column, row
 import numpy as np
 import matplotlib
 from bokeh.plotting import figure
+from visualizer.playback import PlaybackScheduler
+from visualizer.gallery import SelectionGallery
+from visualizer.density import DensityRaster
+from visualizer.profiling import timed
 
 class ImageSensitivityVisualizer:
-    def __init__(self, shared_source, shared_resource, max_epoch, default_color='blue'):
+    @timed
+    def __init__(self, shared_source, shared_resource, max_epoch, default_color='blue', raster_bins=None, raster_threshold=5000,
+                 raster_by_class=False, webgl=False):
+        self.webgl = webgl
         self.source = shared_source
         self.shared_resource = shared_resource
         self.max_epoch = max_epoch
@@ -14,15 +21,21 @@ class ImageSensitivityVisualizer:
         self.plot = self.create_plot()
 
         self.step_slider = Slider(start=0, end=self.max_epoch, value=0, step=1, title="Epoch")
+
+        self.density = None
+        if raster_bins is not None:
+            self.density = DensityRaster(self.plot, self.scatter, self.shared_resource, "epoch",
+                                         labels=self.source.data["label"] if raster_by_class else None,
+                                         bins=raster_bins, threshold=raster_threshold)
+            self.density.link_slider(self.step_slider)
         self.play_pause_button = Button(label="Play")
         self.reset_button = Button(label="Reset", button_type="danger")
         self.clear_button = Button(label="Clear", button_type="warning")  # Add Clear button
 
-        self.image_display = Div(
-            text="<h3>Selected Images:</h3>", 
-            width=300, height=600, 
-            stylesheets=[""" .scroll-box { overflow-y: auto; max-height: 600px; padding: 10px; } """], 
-            css_classes=["scroll-box"]
+        self.gallery = SelectionGallery(
+            self.source,
+            '<img src="data:image/png;base64,{img}" width="64" height="64">',
+            per_row=3, item_width=68, row_height=68, width=300, height=550
         )
 
         self.tracker_colors = ["#d55e00", "#cc79a7", "#0072b2", "#f0e442", "#009e73"]
@@ -69,6 +82,8 @@ class ImageSensitivityVisualizer:
         self.is_playing = False  # Variable to track whether the animation is playing
         self.step_value = 0  # Track the current step
 
+        self.playback = PlaybackScheduler(self.step_slider, self.play_pause_button)
+
         self.setup_callbacks()
 
     def create_plot(self):
@@ -76,11 +91,12 @@ class ImageSensitivityVisualizer:
                    width=600, height=600,
                    tools='tap,box_select, box_zoom, reset',
                    active_drag='box_select',
+                   output_backend="webgl" if self.webgl else "canvas"
                    )
         p.xaxis.axis_label = 'Bayesian Leverage Score'
         p.yaxis.axis_label = 'Bayesian Prediction Error'
 
-        p.scatter(x='bls', y='bpe', color='color', marker='marker', alpha='alpha', size='size', source=self.source)
+        self.scatter = p.scatter(x='bls', y='bpe', color='color', marker='marker', alpha='alpha', size='size', source=self.source)
 
         p.x_range.only_visible = p.y_range.only_visible = True
 
@@ -112,27 +128,6 @@ class ImageSensitivityVisualizer:
             }
         """))
 
-        self.play_pause_button.js_on_click(CustomJS(args={"slider": self.step_slider, "button": self.play_pause_button},
-        code="""
-            var step = slider.value;
-            var is_playing = button.label == "Pause";  // Check if currently playing
-            
-            if (is_playing) {
-                button.label = "Play";  // Change to "Play" when pausing
-                clearTimeout(slider._timeout);
-            } else {
-                button.label = "Pause";  // Change to "Pause" when playing
-                function animate() {
-                    if (step < slider.end) {
-                        step += 1;
-                        slider.value = step;
-                        slider._timeout = setTimeout(animate, 100);
-                    }
-                }
-                animate();
-            }
-        """))
-
         self.reset_button.js_on_click(CustomJS(args={"slider": self.step_slider}, code="""
             slider.value = 0;
         """))
@@ -148,24 +143,11 @@ class ImageSensitivityVisualizer:
             source.change.emit();
         """)) 
 
-        self.source.selected.js_on_change("indices", CustomJS(args={"source": self.source, "image_display": self.image_display}, code="""
-            var indices = source.selected.indices;
-            var images = source.data["img"];
-            var labels = source.data["label"];
-            
-            var html = "<h3>Selected Images:</h3>";
-            for (var i = 0; i < indices.length; i++) {
-                html += "<div style='display:inline-block; margin:5px; text-align:center;'>";
-                html += "<img src='data:image/png;base64," + images[indices[i]] + "' width='64' height='64'><br>";
-                html += "Label: " + labels[indices[i]] + "</div>";
-            }
-            image_display.text = '<div class="scroll-box">' + html + '</div>';
-        """))
 
     def get_layout(self):
         return column(
-            row(self.plot, self.image_display,),
+            row(self.plot, self.gallery.get_layout()),
             row(self.play_pause_button, self.reset_button, self.clear_button),
-            row(self.step_slider),
+            row(self.step_slider, self.playback.get_layout()),
             row(Div(text="Tracker Colors:"), *self.tracker_buttons)
         )
\ No newline at end of file
@@ -1,8 +1,10 @@
 from bokeh.models import ColumnDataSource, HoverTool, Div, CustomJS
 from bokeh.layouts import column, gridplot
 from bokeh.plotting import figure, curdoc
+from visualizer.profiling import timed
 
 class ImageSet:
+    @timed
     def __init__(self, sources, subsample_image):
         self.n_samples = len(sources)  # Number of sampled datapoints
         self.sources = sources
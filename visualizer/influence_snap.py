@@ -2,9 +2,14 @@ from bokeh.models import Button, CustomJS, Slider, ColumnDataSource, Div
 from bokeh.layouts import column
 import numpy as np
 from bokeh.plotting import figure
+from visualizer.playback import PlaybackScheduler
+from visualizer.noisescale import NoiseScale
+from visualizer.profiling import timed
 
 class LSBoundaryVisualizer:
-    def __init__(self, shared_source, shared_resource, max_epoch, colors, mode='Step'):
+    @timed
+    def __init__(self, shared_source, shared_resource, max_epoch, colors, mode='Step', scale_factor=3, webgl=False):
+        self.webgl = webgl
         self.source = shared_source
         self.shared_resource = shared_resource
         self.max_epoch = max_epoch
@@ -29,7 +34,8 @@ class LSBoundaryVisualizer:
             y_range=(y_min, y_max),
             tools="tap, box_select, reset, pan, wheel_zoom",
             active_drag="pan",
-            active_scroll="wheel_zoom"
+            active_scroll="wheel_zoom",
+            output_backend="webgl" if self.webgl else "canvas"
             #tools=""
         )
 
@@ -37,10 +43,13 @@ class LSBoundaryVisualizer:
         initial_ys = shared_resource.data["ys"][0]
         self.boundary_source = ColumnDataSource(data={"xs": initial_xs, "ys": initial_ys})
 
-        self.plot.scatter("x", "y", source=self.source, size="size", color="color", marker="marker", line_color='black', alpha="alpha")
+        self.noise_scale = NoiseScale(self.source, scale_factor=scale_factor)
+
+        self.plot.scatter("x", "y", source=self.source, size=self.noise_scale.size, color="color", marker="marker", line_color='black', alpha=self.noise_scale.alpha)
         self.plot.multi_line(xs="xs", ys="ys", source=self.boundary_source, line_width=2, color="black")
 
         self.step_slider = Slider(start=0, end=self.max_epoch, value=0, step=1, title=mode)
+        self.playback = PlaybackScheduler(self.step_slider, self.play_pause_button, end_label="Restart")
         self.setup_callbacks()
 
     def setup_callbacks(self):
@@ -54,8 +63,7 @@ class LSBoundaryVisualizer:
             var step_index = shared_data["epoch"].indexOf(step);
             
             if (step_index !== -1) {
-                source.data["size"] = shared_data["size"][step_index];
-                source.data["alpha"] = shared_data["alpha"][step_index];
+                source.data["noise"] = shared_data["noise"][step_index];
                 boundary_source.data["xs"] = shared_data["xs"][step_index];
                 boundary_source.data["ys"] = shared_data["ys"][step_index];
 
@@ -64,35 +72,6 @@ class LSBoundaryVisualizer:
             }
         """))
 
-        self.play_pause_button.js_on_click(CustomJS(args={"slider": self.step_slider, "button": self.play_pause_button, "max_epoch": self.max_epoch}, code="""
-            var step = slider.value;
-            var is_playing = button.label == "Pause";
-            var is_at_end = step >= max_epoch;
-            
-            if (is_at_end) {
-                button.label = "Restart";
-                slider.value = 0;
-                step = 0;
-            }
-            
-            if (is_playing) {
-                button.label = "Play";
-                clearTimeout(slider._timeout);
-            } else {
-                button.label = "Pause";
-                function animate() {
-                    if (step < max_epoch) {
-                        step += 1;
-                        slider.value = step;
-                        slider._timeout = setTimeout(animate, 100);
-                    } else {
-                        button.label = "Restart";
-                    }
-                }
-                animate();
-            }
-        """))
-
         self.source.selected.js_on_change('indices', CustomJS(args={'source': self.source, 'original_colors': self.original_colors}, code="""
             const selected_indices = source.selected.indices;
             const new_colors = source.data['color'].slice(); // Create a copy of the current colors
@@ -110,4 +89,4 @@ class LSBoundaryVisualizer:
         """))
 
     def get_layout(self):
-        return column(self.plot, self.step_slider, self.play_pause_button, self.clear_selection_button)
\ No newline at end of file
+        return column(self.plot, self.step_slider, self.playback.get_layout(), self.noise_scale.get_layout(), self.play_pause_button, self.clear_selection_button)
\ No newline at end of file
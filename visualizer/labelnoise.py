@@ -1,11 +1,17 @@
 from bokeh.plotting import figure
 from bokeh.layouts import column, row
-from bokeh.models import HoverTool, ColumnDataSource, Div, CustomJS, Select
+from bokeh.models import HoverTool, CustomJS, Select, CDSView, IndexFilter
 from visualizer.evolvingmpe import EvolvingMemoryMapVisualizer
-from collections import defaultdict
+from visualizer.gallery import SelectionGallery
+from visualizer.lod import LevelOfDetail
+from visualizer.profiling import timed
+import numpy as np
 
 class LabelNoisePlot:
-    def __init__(self, shared_source, plot_name, show_mm=False):
+    @timed
+    def __init__(self, shared_source, plot_name, show_mm=False, lod_budget=None, webgl=False):
+        self.webgl = webgl
+        self.lod_budget = lod_budget
         self.shared_source = shared_source
         self.show_mm = show_mm
         self.plot_name = plot_name
@@ -14,23 +20,22 @@ class LabelNoisePlot:
         self.unique_labels.sort()
         self.unique_labels.insert(0, "All")  # Add an "All" option
         
-        self.filtered_source = ColumnDataSource(data=self.shared_source.data.copy())
+        # Class filtering is a view over the shared source: the dropdown only swaps the row
+        # indices of the chosen class, no column (or image) is copied
+        self.class_filter = IndexFilter(indices=None)
         self.plot = self.create_plot()
-        self.selected_source = ColumnDataSource(data=dict(img=[], label=[]))
         
-        self.image_display = Div(
-            text="<h3>Selected Images:</h3>", 
-            width=500, height=600, 
-            stylesheets=[""" .scroll-box { overflow-y: auto; max-height: 600px; padding: 10px; } """], 
-            css_classes=["scroll-box"]
+        self.gallery = SelectionGallery(
+            self.shared_source,
+            '<img src="data:image/png;base64,{img}" width="56" height="56">',
+            per_row=7, item_width=60, row_height=60, width=500, height=550,
+            refresh_on_data=self.lod_budget is not None
         )
         
         self.dropdown = Select(title="Select Class:", value="All", options=self.unique_labels)
         
-        self.callback = CustomJS(args=dict(source=self.filtered_source, selected_source=self.selected_source, display=self.image_display), code="""
+        self.callback = CustomJS(args=dict(source=self.shared_source), code="""
             var selected_indices = source.selected.indices;
-            var imgs = [];
-            var labels = [];
             
             for (var i = 0; i < source.data['x'].length; i++) {
                 source.data['color'][i] = 'grey';  // Reset all to grey
@@ -38,102 +43,54 @@ class LabelNoisePlot:
             
             for (var i = 0; i < selected_indices.length; i++) {
                 source.data['color'][selected_indices[i]] = 'red';  // Highlight selected points
-                imgs.push(source.data['img'][selected_indices[i]]);
-                labels.push(source.data['label'][selected_indices[i]]);
             }
             
             source.change.emit();
-            
-            // Group images by class
-            var grouped = {};
-            for (var i = 0; i < imgs.length; i++) {
-                var label = labels[i];
-                if (!(label in grouped)) {
-                    grouped[label] = [];
-                }
-                grouped[label].push(imgs[i]);
-            }
-            
-            // Generate HTML with wrapping rows (max 10 images per row)
-            var html = "<div style='display: flex; flex-direction: column; gap: 10px;'>";
-            var sorted_labels = Object.keys(grouped).sort((a, b) => a - b); // Sort classes numerically
+        """)
 
-            for (var j = 0; j < sorted_labels.length; j++) {
-                var label = sorted_labels[j];
-                var images = grouped[label];
+        
+        self.shared_source.selected.js_on_change("indices", self.callback)
+        self.mm_setup()
 
-                html += `<div><b>Class ${label}</b></div>`;
-                html += "<div style='display: flex; flex-direction: column; gap: 5px;'>";
+        # Only a bounded subset is sent at the full view, zooming in either plot sends every point in
+        # its window. A new subset keeps the selection, its highlight is redrawn on the new rows and the
+        # class rows are recomputed for it
+        if self.lod_budget is not None:
+            views = [(self.memory_map_visualizer.plot, "bls", "bpe")] if self.show_mm else []
+            self.lod = LevelOfDetail(self.plot, self.shared_source, budget=self.lod_budget, views=views,
+                                     on_update=self.update_class_rows)
+            self.shared_source.js_on_change("data", self.callback)
 
-                // Break images into lines of max 10 per row
-                for (var k = 0; k < images.length; k += 10) {
-                    html += "<div style='display: flex; flex-wrap: wrap; gap: 5px;'>";
-                    for (var m = k; m < Math.min(k + 10, images.length); m++) {
-                        html += `<img src='data:image/png;base64,${images[m]}' width='56' height='56'>`;
-                    }
-                    html += "</div>";  // Close row
-                }
+    def class_rows(self):
+        # Rows of each class in the current source, which may be a level-of-detail subset
+        labels, inverse = np.unique(np.asarray(self.shared_source.data['label']).astype(str), return_inverse=True)
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.searchsorted(inverse[order], np.arange(len(labels) + 1))
+        return {label: order[bounds[i]:bounds[i + 1]].tolist() for i, label in enumerate(labels)}
 
-                html += "</div>";  // Close class container
-            }
+    def update_class_rows(self):
+        class_rows = self.class_rows()
+        self.apply_filter.args = dict(self.apply_filter.args, class_rows=class_rows)
+        self.class_filter.indices = None if self.dropdown.value == "All" else class_rows.get(self.dropdown.value, [])
 
-            html += "</div>";
-            display.text = '<div class="scroll-box">' + html + '</div>';
+    def mm_setup(self):
+        # The rows of every class are computed on the server, the dropdown only picks one of them
+        self.apply_filter = CustomJS(args=dict(source=self.shared_source, class_filter=self.class_filter, dropdown=self.dropdown,
+                                               class_rows=self.class_rows()), code="""
+            var selected_class = dropdown.value;
+            class_filter.indices = selected_class === 'All' ? null : (class_rows[selected_class] || []);
+            source.selected.indices = [];  // Hidden points must not stay selected
         """)
+        self.dropdown.js_on_change("value", self.apply_filter)
 
-        
-        self.filtered_source.selected.js_on_change("indices", self.callback)
-        self.mm_setup()
-
-    def mm_setup(self):
         if self.show_mm:
-            self.dropdown.js_on_change("value", CustomJS(args=dict(source=self.shared_source, filtered_source=self.filtered_source, dropdown=self.dropdown), code="""
-                var selected_class = dropdown.value;
-                var new_data = {x: [], y: [], label: [], img: [], color: [], bls: [], bpe:[], size:[], marker:[], alpha:[]};
-                
-                for (var i = 0; i < source.data['label'].length; i++) {
-                    if (selected_class === 'All' || source.data['label'][i] === selected_class) {
-                        new_data['x'].push(source.data['x'][i]);
-                        new_data['y'].push(source.data['y'][i]);
-                        new_data['label'].push(source.data['label'][i]);
-                        new_data['img'].push(source.data['img'][i]);
-                        new_data['color'].push(source.data['color'][i]);
-                        new_data['bls'].push(source.data['bls'][i]);
-                        new_data['bpe'].push(source.data['bpe'][i]);
-                        new_data['size'].push(source.data['size'][i]);
-                        new_data['marker'].push(source.data['marker'][i]);
-                        new_data['alpha'].push(source.data['alpha'][i]);                      
-                    }
-                }
-                
-                filtered_source.data = new_data;
-                filtered_source.change.emit();
-            """))
-            self.memory_map_visualizer = EvolvingMemoryMapVisualizer(self.filtered_source)
+            self.memory_map_visualizer = EvolvingMemoryMapVisualizer(self.shared_source, view=CDSView(filter=self.class_filter), webgl=self.webgl)
             self.memory_map_layout = column(self.memory_map_visualizer.get_layout(), width=500)
-        else:
-            self.dropdown.js_on_change("value", CustomJS(args=dict(source=self.shared_source, filtered_source=self.filtered_source, dropdown=self.dropdown), code="""
-                var selected_class = dropdown.value;
-                var new_data = {x: [], y: [], label: [], img: [], color: []};
-                
-                for (var i = 0; i < source.data['label'].length; i++) {
-                    if (selected_class === 'All' || source.data['label'][i] === selected_class) {
-                        new_data['x'].push(source.data['x'][i]);
-                        new_data['y'].push(source.data['y'][i]);
-                        new_data['label'].push(source.data['label'][i]);
-                        new_data['img'].push(source.data['img'][i]);
-                        new_data['color'].push(source.data['color'][i]);                   
-                    }
-                }
-                
-                filtered_source.data = new_data;
-                filtered_source.change.emit();
-            """))
 
     def create_plot(self):
-        p = figure(width=800, height=600, tools="reset,save,box_select",
+        p = figure(width=800, height=600, tools="reset,save,box_select,box_zoom,wheel_zoom" if self.lod_budget is not None else "reset,save,box_select",
            title=f"{self.plot_name} Label Noise Distribution",
-           x_axis_label="Examples", y_axis_label=r"Label Noise ||ε||₂")
+           x_axis_label="Examples", y_axis_label=r"Label Noise ||ε||₂", output_backend="webgl" if self.webgl else "canvas")
         p.title.text_font_size = "25px"
         p.title.align = 'center'
         p.xaxis.visible = False
@@ -141,10 +98,11 @@ class LabelNoisePlot:
         p.yaxis.axis_label_text_font_size = "20pt"
         p.xaxis.axis_label_text_font_size = "20pt"
 
+        view = CDSView(filter=self.class_filter)
         if self.show_mm:
-            p.scatter("x", "y", source=self.filtered_source, size=6, color="color", legend_label="Data", fill_alpha="alpha", marker="marker")
+            p.scatter("x", "y", source=self.shared_source, view=view, size=6, color="color", legend_label="Data", fill_alpha="alpha", marker="marker")
         else:
-            p.scatter("x", "y", source=self.filtered_source, size=6, color="color", legend_label="Data", fill_alpha=0.6)
+            p.scatter("x", "y", source=self.shared_source, view=view, size=6, color="color", legend_label="Data", fill_alpha=0.6)
 
         hover = HoverTool(tooltips="""
             <div>
@@ -157,13 +115,8 @@ class LabelNoisePlot:
 
         return p
     
-    def generate_html(self, img_list, label_list):
-        items = [f'<div><img src="data:image/png;base64,{img}" width="56" height="56"><br>Label: {label}</div>'
-                for img, label in zip(img_list, label_list)]
-        return "<div style='display: flex; flex-wrap: wrap; gap: 10px;'>" + "".join(items) + "</div>"
-    
     def get_layout(self):
         if self.show_mm:
-            return column(row(self.memory_map_layout, self.plot, self.image_display), self.dropdown)
+            return column(row(self.memory_map_layout, self.plot, self.gallery.get_layout()), self.dropdown)
         else:
-            return column(row(self.plot, self.image_display), self.dropdown)
\ No newline at end of file
+            return column(row(self.plot, self.gallery.get_layout()), self.dropdown)
\ No newline at end of file
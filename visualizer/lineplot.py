@@ -2,10 +2,14 @@ from bokeh.models import Button, CustomJS, Slider, ColumnDataSource, Div
 from bokeh.layouts import column
 import numpy as np
 from bokeh.plotting import figure
+from visualizer.profiling import timed
 
 class LinePlot:
-    def __init__(self, shared_source, min_x, max_x):
+    @timed
+    def __init__(self, shared_source, min_x, max_x, size='size', webgl=False):
+        self.webgl = webgl
         self.source = shared_source
+        self.size = size
         self.min_x = min_x
         self.max_x = max_x
 
@@ -16,12 +20,12 @@ class LinePlot:
                            width=600,
                            title="Single Axis Plot",
                            tools="",
-                           x_range=(self.min_x-1, self.max_x+1))
+                           x_range=(self.min_x-1, self.max_x+1), output_backend="webgl" if self.webgl else "canvas")
         p.yaxis.visible = False
         p.xaxis.axis_line_color = None
         p.xaxis.major_tick_line_color = None
         p.xaxis.minor_tick_line_color = None
-        p.scatter("sig_in", "fixed_axis", source=self.source, size='size', color='color',  marker="marker", line_color='black')
+        p.scatter("sig_in", "fixed_axis", source=self.source, size=self.size, color='color',  marker="marker", line_color='black')
         return p
 
     def get_layout(self):
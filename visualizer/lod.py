@@ -0,0 +1,96 @@
+from functools import partial
+from bokeh.events import RangesUpdate
+from bokeh.models import Range1d
+from bokeh.plotting import curdoc
+import numpy as np
+from visualizer.profiling import timed
+
+class LevelOfDetail:
+    @timed
+    def __init__(self, plot, source, x="x", y="y", budget=5000, views=(), n_extremes=50, seed=0, on_update=None):
+        self.source = source
+        self.budget = budget
+        self.n_extremes = n_extremes
+        # Called after every new subset, before its selection is set
+        self.on_update = on_update
+
+        # Full resolution columns stay on the server, the source only holds the rows in view
+        self.full = {name: np.asarray(values, dtype=object) if isinstance(values, list) else np.asarray(values)
+                     for name, values in source.data.items()}
+        self.n = len(self.full[x])
+
+        # Every plot drawing the source is a view with its own window, given as (plot, x, y). The
+        # source holds the union of the rows each view needs, so a point stays reachable by zooming
+        # in any of them
+        self.views = [(plot, x, y)] + list(views)
+        self.windows = [None] * len(self.views)
+
+        # A fixed random priority per point gives a uniform (density preserving) subset that does
+        # not flicker between updates; the extreme points along each view's axes are always kept
+        self.priority = np.random.default_rng(seed).permutation(self.n)
+        self.orders = [[np.argsort(self.full[field], kind="stable") for field in (vx, vy)] for _, vx, vy in self.views]
+
+        # Ranges fixed to the full extent, so reset returns to the full view rather than fitting the subset
+        for view_plot, vx, vy in self.views:
+            view_plot.x_range = self.full_range(self.full[vx])
+            view_plot.y_range = self.full_range(self.full[vy])
+
+        # Selection as full-data rows, so it survives the subset being replaced
+        self.selected = np.empty(0, dtype=int)
+        self.updating = False
+
+        self.rows = None
+        self.update()
+        # Static HTML output keeps the full view subset, zooming only refines under a server
+        if curdoc().session_context is not None:
+            for i, (view_plot, _, _) in enumerate(self.views):
+                view_plot.on_event(RangesUpdate, partial(self.on_ranges, i))
+            self.source.selected.on_change("indices", self.on_selection)
+
+    def full_range(self, values):
+        low, high = float(np.min(values)), float(np.max(values))
+        padding = 0.05 * (high - low) if high > low else 1.0
+        return Range1d(low - padding, high + padding)
+
+    def window_rows(self, view, window):
+        _, x, y = self.views[view]
+        inside = np.ones(self.n, dtype=bool)
+        if window is not None:
+            x0, x1, y0, y1 = window
+            xs, ys = self.full[x], self.full[y]
+            inside &= (xs >= min(x0, x1)) & (xs <= max(x0, x1)) & (ys >= min(y0, y1)) & (ys <= max(y0, y1))
+
+        rows = np.flatnonzero(inside)
+        if len(rows) <= self.budget:
+            return rows
+
+        keep = [rows[np.argpartition(self.priority[rows], self.budget)[:self.budget]]]
+        for order in self.orders[view]:
+            ranked = order[inside[order]]
+            keep.append(ranked[:self.n_extremes])
+            keep.append(ranked[-self.n_extremes:])
+        return np.unique(np.concatenate(keep))
+
+    def update(self):
+        rows = np.unique(np.concatenate([self.window_rows(i, window) for i, window in enumerate(self.windows)]
+                                        + [self.selected]))
+        if self.rows is not None and np.array_equal(rows, self.rows):
+            return
+
+        self.rows = rows
+        # The data is replaced before the selection, whose indices refer to the new subset
+        self.updating = True
+        self.source.data = {name: column[rows].tolist() if column.dtype == object else column[rows]
+                            for name, column in self.full.items()}
+        if self.on_update is not None:
+            self.on_update()
+        self.source.selected.indices = np.flatnonzero(np.isin(rows, self.selected)).tolist()
+        self.updating = False
+
+    def on_selection(self, attr, old, new):
+        if not self.updating:
+            self.selected = self.rows[np.asarray(new, dtype=int)]
+
+    def on_ranges(self, view, event):
+        self.windows[view] = (event.x0, event.x1, event.y0, event.y1)
+        self.update()
@@ -2,9 +2,14 @@ from bokeh.models import Button, CustomJS, Slider, ColumnDataSource, Div
 from bokeh.layouts import column
 import numpy as np
 from bokeh.plotting import figure
+from visualizer.playback import PlaybackScheduler
+from visualizer.noisescale import NoiseScale
+from visualizer.profiling import timed
 
 class LSBoundaryVisualizer:
-    def __init__(self, shared_source, shared_resource, max_step, colors, total_batches, mode='Step', sig_projection=False):
+    @timed
+    def __init__(self, shared_source, shared_resource, max_step, colors, total_batches, mode='Step', sig_projection=False, scale_factor=3, size_bounds=None, alpha_levels=None, webgl=False):
+        self.webgl = webgl
         self.source = shared_source
         self.shared_resource = shared_resource
         self.max_step = max_step
@@ -33,7 +38,8 @@ class LSBoundaryVisualizer:
             y_range=(y_min, y_max),
             tools="tap, box_select, reset, pan, wheel_zoom",
             active_drag="pan",
-            active_scroll="wheel_zoom"
+            active_scroll="wheel_zoom",
+            output_backend="webgl" if self.webgl else "canvas"
             #tools=""
         )
 
@@ -41,10 +47,13 @@ class LSBoundaryVisualizer:
         initial_ys = shared_resource.data["ys"][0]
         self.boundary_source = ColumnDataSource(data={"xs": initial_xs, "ys": initial_ys})
 
-        self.plot.scatter("x", "y", source=self.source, size="size", color="color", marker="marker", line_color='black', alpha="alpha")
+        self.noise_scale = NoiseScale(self.source, scale_factor=scale_factor, size_bounds=size_bounds, alpha_levels=alpha_levels)
+
+        self.plot.scatter("x", "y", source=self.source, size=self.noise_scale.size, color="color", marker="marker", line_color='black', alpha=self.noise_scale.alpha)
         self.plot.multi_line(xs="xs", ys="ys", source=self.boundary_source, line_width=2, color="black")
 
         self.step_slider = Slider(start=0, end=self.max_step, value=0, step=1, title=mode)
+        self.playback = PlaybackScheduler(self.step_slider, self.play_pause_button, end_label="Restart")
         self.setup_callbacks()
 
     def setup_callbacks(self):
@@ -62,15 +71,13 @@ class LSBoundaryVisualizer:
             epoch_display.text = "Epoch: " + current_epoch;
             
             if (step_index != -1){
-                source.data["size"] = shared_data["size"][step_index];
-                source.data["alpha"] = shared_data["alpha"][step_index];
+                source.data["noise"] = shared_data["noise"][step_index];
                 boundary_source.data["xs"] = shared_data["xs"][step_index];
                 boundary_source.data["ys"] = shared_data["ys"][step_index];
 
                 if (toggle){
                     source.data["logits"] = shared_data["logits"][step_index];
                     source.data["sig_in"] = shared_data["sig_in"][step_index];
-                    source.data["noise"] = shared_data["noise"][step_index];
                 }
 
                 source.change.emit();
@@ -78,40 +85,6 @@ class LSBoundaryVisualizer:
             }
         """))
 
-        self.play_pause_button.js_on_click(CustomJS(args={"slider": self.step_slider, "button": self.play_pause_button, "max_step": self.max_step, "epoch_display": self.epoch_display, "total_batches": self.total_batches}, code="""
-            var step = slider.value;
-            var is_playing = button.label == "Pause";
-            var is_at_end = step >= max_step;
-            var current_epoch = Math.floor(step / total_batches);
-            epoch_display.text = "Epoch: " + current_epoch;
-            
-            if (is_at_end) {
-                button.label = "Restart";
-                slider.value = 0;
-                step = 0;
-                epoch_display.text = "Epoch: 0";
-            }
-            
-            if (is_playing) {
-                button.label = "Play";
-                clearTimeout(slider._timeout);
-            } else {
-                button.label = "Pause";
-                function animate() {
-                    if (step < max_step) {
-                        step += 1;
-                        slider.value = step;
-                        var current_epoch = Math.floor(step / total_batches);
-                        epoch_display.text = "Epoch: " + current_epoch;
-                        slider._timeout = setTimeout(animate, 100);
-                    } else {
-                        button.label = "Restart";
-                    }
-                }
-                animate();
-            }
-        """))
-
         self.source.selected.js_on_change('indices', CustomJS(args={'source': self.source, 'original_colors': self.original_colors}, code="""
             const selected_indices = source.selected.indices;
             const new_colors = source.data['color'].slice(); // Create a copy of the current colors
@@ -129,4 +102,4 @@ class LSBoundaryVisualizer:
         """))
 
     def get_layout(self):
-        return column(self.plot, self.epoch_display, self.step_slider, self.play_pause_button, self.clear_selection_button)
\ No newline at end of file
+        return column(self.plot, self.epoch_display, self.step_slider, self.playback.get_layout(), self.noise_scale.get_layout(), self.play_pause_button, self.clear_selection_button)
\ No newline at end of file
@@ -1,16 +1,20 @@
 from bokeh.plotting import figure
 from bokeh.layouts import column
 from bokeh.models import Button, Div
+import numpy as np
+from visualizer.profiling import timed
 
 class MemoryMapVisualizer:
-    def __init__(self, shared_source, colors, decisionboundaryvisualizer):
+    @timed
+    def __init__(self, shared_source, colors, decisionboundaryvisualizer, webgl=False):
+        self.webgl = webgl
         self.source = shared_source
 
         # Set up the plot
         self.plot = figure(title="Memory Map Visualization",
                            width=600, height=600,
                            tools="tap,box_select,box_zoom,reset,pan",
-                           active_drag="box_select")
+                           active_drag="box_select", output_backend="webgl" if self.webgl else "canvas")
         self.plot.xaxis.axis_label = 'BLS'  # Label for x-axis
         self.plot.yaxis.axis_label = 'BPE'
         self.plot.scatter("bls", "bpe", size=8, source=self.source, color="color", marker="marker")
@@ -32,66 +36,52 @@ class MemoryMapVisualizer:
 
         self.message_div = Div(text="", width=400, height=25)
         self.colors = colors
-        self.ind = []
+        self.class_colors = np.array(colors, dtype=object)[np.asarray(self.source.data["class"], dtype=int)]
 
-    def update_selection(self, attr, old, new):
-        selected_indices = self.source.selected.indices
-        new_data = self.source.data.copy()
+    def patch_colors(self, colors):
+        # Only the entries that actually change are sent to the browser
+        changed = np.flatnonzero(np.asarray(self.source.data["color"], dtype=object) != colors)
+        if len(changed):
+            self.source.patch({"color": [(int(idx), colors[idx]) for idx in changed]})
 
-        for idx in range(len(new_data['color'])):
-            if idx in selected_indices:
-                if new_data["color"][idx] != "red":
-                    new_data["color"][idx] = "red"
-                else:
-                    new_data["color"][idx] = self.colors[int(new_data["class"][idx])]
+    def update_selection(self, attr, old, new):
+        selected = np.asarray(self.source.selected.indices, dtype=int)
+        if len(selected) == 0:
+            return
 
-        self.source.data = new_data
-        self.ind.extend(selected_indices)
+        colors = np.array(self.source.data["color"], dtype=object)
+        # Selected points toggle between red and their class colour
+        colors[selected] = np.where(colors[selected] != "red", "red", self.class_colors[selected])
+        self.patch_colors(colors)
 
     def confirm_selection(self):
-        new_data = self.source.data.copy()
-
-        for idx in self.ind:
-            # Confirm selected points by setting color to grey
-            if new_data["color"][idx] == "red":
-                new_data["color"][idx] = "grey"
+        colors = np.array(self.source.data["color"], dtype=object)
+        # Confirm selected points by setting color to grey
+        colors[colors == "red"] = "grey"
 
-        self.source.data = new_data
+        self.patch_colors(colors)
         self.source.selected.indices = []  # Clear selection
         self.message_div.text = "Selection confirmed."
         self.decisionboundaryvisualizer.update(None, None, None)
 
     def reset_selection(self):
-        new_data = self.source.data.copy()
-
-        for idx in range(len(new_data["color"])):
-            new_data["color"][idx] = self.colors[int(new_data["class"][idx])]
-
-        self.source.data = new_data
+        self.patch_colors(self.class_colors)
         self.source.selected.indices = []  # Clear selection
         self.message_div.text = "Selections reset."
         self.decisionboundaryvisualizer.update(None, None, None)
 
     def invert_selection(self):
-        new_data = self.source.data.copy()
-        count = 0
-
-        for idx in range(len(new_data["color"])):
-            if new_data["color"][idx] != 'grey':
-                new_data["color"][idx] = 'grey'
-            elif new_data["color"][idx] == 'red':
-                pass
-            else:
-                if new_data["color"][idx] != self.colors[int(new_data["class"][idx])]:
-                    new_data["color"][idx] = self.colors[int(new_data["class"][idx])]
-                else:
-                    count+=1
-        if count < len(new_data["color"]):
+        colors = np.array(self.source.data["color"], dtype=object)
+        grey = colors == "grey"
+        count = np.count_nonzero(grey & (self.class_colors == "grey"))
+
+        colors = np.where(grey, self.class_colors, "grey").astype(object)
+        if count < len(colors):
             print("inverted")
-            self.source.data = new_data
+            self.patch_colors(colors)
             self.decisionboundaryvisualizer.update(None, None, None)
         else:
-            self.reset_selection
+            self.reset_selection()
         self.source.selected.indices = []
 
     def get_plot(self):
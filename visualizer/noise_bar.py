@@ -1,8 +1,10 @@
 from bokeh.models import ColumnDataSource
 from bokeh.plotting import figure
 import numpy as np
+from visualizer.profiling import timed
 
 class BarProjectionPlot:
+    @timed
     def __init__(self, shared_source, min_x, max_x, bar_width=0.001):
         self.source = shared_source
         self.bar_width = bar_width
@@ -0,0 +1,60 @@
+from bokeh.models import CustomJS, CustomJSTransform, Slider
+from bokeh.transform import transform
+from visualizer.profiling import timed
+
+class NoiseScale:
+    @timed
+    def __init__(self, source, field="noise", scale_factor=3, max_scale=10, size_range=(5, 50), alpha_range=(0.2, 1.0),
+                 size_bounds=None, alpha_levels=None):
+        self.source = source
+        self.field = field
+
+        self.scale_slider = Slider(start=1, end=max(max_scale, scale_factor), value=scale_factor, step=1, title="Scale factor")
+
+        # Only the raw per-step values are shipped, size and alpha are mapped in the browser from the
+        # current step's min/max (or fixed bounds), raised to the live scale factor
+        self.size_transform = self.create_transform(size_range, size_bounds, None)
+        self.alpha_transform = self.create_transform(alpha_range, None, alpha_levels)
+        self.size = transform(self.field, self.size_transform)
+        self.alpha = transform(self.field, self.alpha_transform)
+
+        self.setup_callbacks()
+
+    def create_transform(self, out_range, bounds, levels):
+        return CustomJSTransform(args={"scale": self.scale_slider,
+                                       "out_range": list(out_range),
+                                       "bounds": list(bounds) if bounds is not None else None,
+                                       "levels": list(levels) if levels is not None else None},
+        v_func="""
+            var lo = Infinity, hi = -Infinity;
+            if (bounds !== null) {
+                lo = bounds[0];
+                hi = bounds[1];
+            } else {
+                for (var i = 0; i < xs.length; i++) {
+                    if (xs[i] < lo) { lo = xs[i]; }
+                    if (xs[i] > hi) { hi = xs[i]; }
+                }
+            }
+
+            var out = new Float64Array(xs.length);
+            for (var i = 0; i < xs.length; i++) {
+                var value = Math.pow((xs[i] - lo) / (hi - lo + 1e-8), scale.value);
+                if (levels !== null) {
+                    // Equal-width bins over the normalised value, one alpha level per bin
+                    out[i] = levels[Math.min(Math.floor(value * levels.length), levels.length - 1)];
+                } else {
+                    out[i] = out_range[0] + (out_range[1] - out_range[0]) * value;
+                }
+            }
+            return out;
+        """)
+
+    def setup_callbacks(self):
+        # Transforms are re-evaluated when the source changes
+        self.scale_slider.js_on_change("value", CustomJS(args={"source": self.source}, code="""
+            source.change.emit();
+        """))
+
+    def get_layout(self):
+        return self.scale_slider
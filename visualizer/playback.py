@@ -0,0 +1,83 @@
+from bokeh.models import CustomJS, Slider
+from visualizer.profiling import timed
+
+class PlaybackScheduler:
+    @timed
+    def __init__(self, slider, button, speed=10, max_speed=60, target_fps=30, end_label="Play"):
+        self.slider = slider
+        self.button = button
+        self.target_fps = target_fps
+        self.end_label = end_label
+
+        self.speed_slider = Slider(start=1, end=max_speed, value=speed, step=1, title="Speed (steps/s)")
+
+        self.setup_callbacks()
+
+    def setup_callbacks(self):
+        # Playback is driven by requestAnimationFrame instead of a fixed setTimeout/setInterval:
+        # the slider only advances once the previous frame has been painted, and when frames
+        # take longer than the budget the owed steps are jumped over in one go so playback
+        # keeps its speed instead of queueing up work.
+        self.button.js_on_click(CustomJS(args={"slider": self.slider,
+                                               "button": self.button,
+                                               "speed": self.speed_slider,
+                                               "target_fps": self.target_fps,
+                                               "end_label": self.end_label,
+                                               "title": self.speed_slider.title},
+        code="""
+            var player = button._player;
+
+            if (player && player.running) {
+                player.running = false;
+                cancelAnimationFrame(player.frame);
+                button.label = "Play";
+                speed.title = title;
+                return;
+            }
+
+            if (slider.value >= slider.end) {
+                slider.value = slider.start;  // Restart from the beginning once the end was reached
+            }
+
+            var budget = 1000 / target_fps;
+            player = button._player = {running: true, last: null, last_step: null, pending: 0, frame_ms: budget, frame: null};
+            button.label = "Pause";
+
+            function tick(now) {
+                if (!player.running) {
+                    return;
+                }
+                if (player.last === null) {
+                    player.last = player.last_step = now;
+                }
+
+                // Time between painted frames, i.e. what the previous step cost to render
+                var elapsed = now - player.last;
+                player.last = now;
+                player.frame_ms = 0.8 * player.frame_ms + 0.2 * elapsed;
+                player.pending += elapsed * speed.value / 1000;
+
+                // Never step faster than the target FPS or than frames are measured to render; the
+                // steps owed meanwhile are jumped at once, so slow renders skip more steps per update
+                var steps = Math.floor(player.pending);
+                if (steps > 0 && now - player.last_step >= Math.max(budget, player.frame_ms)) {
+                    player.pending -= steps;
+                    player.last_step = now;
+                    slider.value = Math.min(slider.value + steps, slider.end);
+                    speed.title = title + ", " + Math.round(1000 / player.frame_ms) + " fps";
+                }
+
+                if (slider.value >= slider.end) {
+                    player.running = false;
+                    button.label = end_label;
+                    speed.title = title;
+                    return;
+                }
+                player.frame = requestAnimationFrame(tick);
+            }
+
+            player.frame = requestAnimationFrame(tick);
+        """))
+
+    def get_layout(self):
+        return self.speed_slider
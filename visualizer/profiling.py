@@ -0,0 +1,190 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+from bokeh.core.json_encoder import serialize_json
+from bokeh.core.serialization import Serializer
+from bokeh.document.events import DocumentPatchedEvent
+from bokeh.models import Div
+
+# The profiler of the document being built, scripts run one at a time per thread under a server
+_local = threading.local()
+
+def rss_mb():
+    # Current resident set size on Linux, the peak so far where /proc is not available
+    try:
+        with open("/proc/self/statm") as fo:
+            return int(fo.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError, AttributeError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+class Profiler:
+    def __init__(self, name, log_file=None, trace_memory=False):
+        self.name = name
+        self.log_file = log_file
+        self.trace_memory = trace_memory
+        self.records = []
+        self.stack = []
+        self.start = time.perf_counter()
+        self.start_rss = rss_mb()
+
+        self.started_tracing = trace_memory and not tracemalloc.is_tracing()
+        if self.started_tracing:
+            tracemalloc.start()
+
+    @contextmanager
+    def phase(self, name):
+        record = {"app": self.name, "phase": name, "depth": len(self.stack),
+                  "start": time.perf_counter() - self.start, "rss_before_mb": rss_mb()}
+        if self.trace_memory:
+            # The traced peak is reset for each phase, a nested phase hands its peak on to the outer one
+            record["traced_mb"] = tracemalloc.get_traced_memory()[0] / 2**20
+            record["child_peak_mb"] = 0.0
+            if self.stack:
+                self.stack[-1]["child_peak_mb"] = max(self.stack[-1]["child_peak_mb"], tracemalloc.get_traced_memory()[1] / 2**20)
+            tracemalloc.reset_peak()
+        self.stack.append(record)
+        try:
+            yield record
+        finally:
+            self.stack.pop()
+            record["seconds"] = time.perf_counter() - self.start - record["start"]
+            record["rss_mb"] = rss_mb()
+            record["rss_delta_mb"] = record["rss_mb"] - record.pop("rss_before_mb")
+            if self.trace_memory:
+                peak = max(tracemalloc.get_traced_memory()[1] / 2**20, record.pop("child_peak_mb"))
+                record["traced_peak_mb"] = peak - record.pop("traced_mb")
+                if self.stack:
+                    self.stack[-1]["child_peak_mb"] = max(self.stack[-1]["child_peak_mb"], peak)
+            self.records.append(record)
+
+    def measure_document(self, doc):
+        # The document is serialized the same way a new session receives it, the size is the message size
+        with self.phase("serialize") as record:
+            record["bytes"] = len(serialize_json(doc.to_json(deferred=False)))
+
+    def finish(self):
+        if self.started_tracing:
+            tracemalloc.stop()
+        self.records.sort(key=lambda record: record["start"])
+
+        if self.log_file is not None:
+            with open(self.log_file, "a") as fo:
+                for record in self.records:
+                    fo.write(json.dumps(record) + "\n")
+
+        total = time.perf_counter() - self.start
+        print(f"Profile of {self.name}: {total:.2f}s, {rss_mb() - self.start_rss:+.1f} MB RSS")
+        for record in self.records:
+            print(f"  {'  ' * record['depth']}{record['phase']}: {record['seconds']:.3f}s, {record['rss_delta_mb']:+.1f} MB RSS"
+                  + (f", {record['traced_peak_mb']:.1f} MB traced peak" if "traced_peak_mb" in record else "")
+                  + (f", {record['bytes'] / 2**10:.0f} KB serialized" if "bytes" in record else ""))
+
+    def summary_div(self):
+        rows = "".join(
+            f"<tr><td style='padding-left:{8 + 16 * record['depth']}px'>{record['phase']}</td>"
+            f"<td>{record['seconds']:.3f}s</td><td>{record['rss_delta_mb']:+.1f} MB</td>"
+            f"<td>{'' if 'traced_peak_mb' not in record else '%.1f MB' % record['traced_peak_mb']}</td>"
+            f"<td>{'' if 'bytes' not in record else '%.0f KB' % (record['bytes'] / 2**10)}</td></tr>"
+            for record in self.records
+        )
+        return Div(text=f"""
+            <table style="font-family: monospace; font-size: 12px; border-collapse: collapse;">
+                <tr><th align="left">Phase</th><th>Time</th><th>RSS</th><th>Traced peak</th><th>Serialized</th></tr>
+                {rows}
+            </table>
+        """, width=600)
+
+class MessageLog:
+    def __init__(self, name, log_file):
+        self.name = name
+        self.log_file = log_file
+        self.overhead = 0.0
+
+    def watch(self, doc):
+        doc.on_change(self.record_sent)
+        # Every change from the browser is applied through apply_json_patch, the Python callbacks it
+        # triggers run inside it
+        apply_json_patch = doc.apply_json_patch
+        def timed_patch(patch, **kwargs):
+            # Measuring the changes sent meanwhile is not part of the handling time
+            start = time.perf_counter()
+            self.overhead = 0.0
+            try:
+                apply_json_patch(patch, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start - self.overhead
+                self.write({"direction": "received", "message": "PATCH-DOC", "ms": elapsed * 1000})
+        doc.apply_json_patch = timed_patch
+
+    def record_sent(self, event):
+        # Changes made on the server, e.g. by a Python callback, are sent to the browser. Changes coming
+        # from the browser have its session as setter and are not sent back
+        if not isinstance(event, DocumentPatchedEvent) or event.setter is not None:
+            return
+        # Models already in the document are counted as references, binary buffers with their size
+        start = time.perf_counter()
+        serialized = Serializer(references=set(event.document.models), deferred=False).serialize(event)
+        size = len(serialize_json(serialized.content)) + sum(len(buffer.to_bytes()) for buffer in serialized.buffers)
+        self.write({"direction": "sent", "message": type(event).__name__, "bytes": size})
+        self.overhead += time.perf_counter() - start
+
+    def write(self, record):
+        with open(self.log_file, "a") as fo:
+            fo.write(json.dumps({"app": self.name, "time": time.time(), **record}) + "\n")
+
+def add_profile_args(parser):
+    parser.add_argument("--profile", action="store_true", help="Time each phase of building the page with its memory use, print a summary and show it below the plots")
+    parser.add_argument("--no-profile", dest="profile", action="store_false", help="Build the page without profiling")
+    parser.add_argument("--profile_log", type=str, default=None, help="If specified with --profile, append one JSON record per phase to this file")
+    parser.add_argument("--profile_memory", action="store_true", help="Also trace the peak Python memory of each phase with tracemalloc, which slows the page build down")
+    parser.add_argument("--no-profile_memory", dest="profile_memory", action="store_false", help="Only record the resident set size of each phase")
+    parser.add_argument("--message_log", type=str, default=None, help="If specified under a Bokeh server, append the handling time of every change received from the browser and the serialized size of every change sent to it to this file")
+
+def start_profile(name, args):
+    # A profiler is only active with --profile, every phase is a no-op otherwise
+    _local.profiler = Profiler(name, log_file=args.profile_log, trace_memory=args.profile_memory) if args.profile else None
+    _local.messages = MessageLog(name, args.message_log) if args.message_log is not None else None
+    return _local.profiler
+
+def get_profiler():
+    return getattr(_local, "profiler", None)
+
+@contextmanager
+def phase(name):
+    profiler = get_profiler()
+    if profiler is None:
+        yield None
+    else:
+        with profiler.phase(name) as record:
+            yield record
+
+def timed(func):
+    # Times every call of func as a phase named after it, e.g. a visualizer's __init__
+    name = func.__qualname__.replace(".__init__", "")
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with phase(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+def finish_profile(doc):
+    # Serializes the finished document and adds the summary below it
+    profiler = get_profiler()
+    if profiler is not None:
+        _local.profiler = None
+        profiler.measure_document(doc)
+        profiler.finish()
+        doc.add_root(profiler.summary_div())
+
+    # Messages are only logged once the document is built, the initial document is sent whole
+    messages = getattr(_local, "messages", None)
+    _local.messages = None
+    if messages is not None and doc.session_context is not None:
+        messages.watch(doc)
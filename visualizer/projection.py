@@ -2,10 +2,14 @@ from bokeh.models import Button, CustomJS, Slider, ColumnDataSource, Div
 from bokeh.layouts import column
 import numpy as np
 from bokeh.plotting import figure
+from visualizer.profiling import timed
 
 class ProjectionPlot:
-    def __init__(self, shared_source, min_x, max_x):
+    @timed
+    def __init__(self, shared_source, min_x, max_x, size='size', webgl=False):
+        self.webgl = webgl
         self.source = shared_source
+        self.size = size
         self.min = min_x
         self.max = max_x
 
@@ -15,7 +19,7 @@ class ProjectionPlot:
         p = figure(height=600,
                            width=600,
                            title="Sigmoid Plot",
-                           tools="")
+                           tools="", output_backend="webgl" if self.webgl else "canvas")
         p.yaxis.visible = False
         p.xaxis.axis_line_color = None
         p.xaxis.major_tick_line_color = None
@@ -25,7 +29,7 @@ class ProjectionPlot:
         sigmoid_y = 1 / (1 + np.exp(-x_sigmoid))
         p.line(x_sigmoid, sigmoid_y, color="blue", line_width=2, legend_label="Sigmoid")
 
-        p.scatter("sig_in", "logits", source=self.source, size='size', color='color',  marker="marker", line_color='black')
+        p.scatter("sig_in", "logits", source=self.source, size=self.size, color='color',  marker="marker", line_color='black')
         p.legend.location = "top_left"
 
         return p
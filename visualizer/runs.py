@@ -0,0 +1,423 @@
+import base64
+import json
+import os
+import pickle
+import tempfile
+from io import BytesIO
+import h5py
+import numpy as np
+import matplotlib.cm as cm
+import matplotlib.pyplot as plt
+from PIL import Image
+from skimage import measure
+from visualizer.profiling import timed
+
+CIFAR10_CLASSES = [
+    "airplane", "automobile", "bird", "cat", "deer",
+    "dog", "frog", "horse", "ship", "truck"
+]
+CIFAR10_TRAIN_SHAPE = (50000, 32, 32, 3)
+
+def read_config(f):
+    read = f["config"]["config_data"][()]
+    config_json = read.decode("utf-8")
+    return json.loads(config_json)
+
+def extract_boundary_lines(xx, yy, zz, tolerance=0):
+    contours = measure.find_contours(zz, level=0.5)  # Assuming boundary at 0.5 probability
+    xs, ys = [], []
+    for contour in contours:
+        if tolerance > 0:
+            # Douglas-Peucker in grid cells, the drawn line moves by at most tolerance cells
+            contour = measure.approximate_polygon(contour, tolerance)
+        xs.append(xx[0, 0] + contour[:, 1] * (xx[0, -1] - xx[0, 0]) / zz.shape[1])
+        ys.append(yy[0, 0] + contour[:, 0] * (yy[-1, 0] - yy[0, 0]) / zz.shape[0])
+    return xs, ys
+
+@timed
+def extract_boundaries(f, groups, tolerance=0):
+    xs = []
+    ys = []
+    for group in groups:
+        boundary = f[group]["decision_boundary"]
+        boundary_x, boundary_y = extract_boundary_lines(boundary["xx"][:], boundary["yy"][:], boundary["Z"][:], tolerance)
+        xs.append(boundary_x)
+        ys.append(boundary_y)
+    return xs, ys
+
+def stream_norm(dataset, chunk_bytes=64 * 2**20):
+    # Sum of squares accumulated over blocks of rows, only one block is held in memory at a time
+    if dataset.ndim == 0:
+        return float(np.linalg.norm(dataset[()]))
+    row_bytes = max(1, dataset.dtype.itemsize * int(np.prod(dataset.shape[1:])))
+    rows = max(1, chunk_bytes // row_bytes)
+    total = 0.0
+    for start in range(0, dataset.shape[0], rows):
+        block = np.asarray(dataset[start:start + rows], dtype=np.float64)
+        total += np.square(block).sum()
+    return float(np.sqrt(total))
+
+@timed
+def load_update_norms(f, h5_file, max_step):
+    # Norms are cached next to the file and reused while the file is unchanged
+    cache_file = os.path.splitext(h5_file)[0] + ".param_norms.npz"
+    stat = os.stat(h5_file)
+    if os.path.isfile(cache_file):
+        cached = np.load(cache_file)
+        if cached["mtime"] == stat.st_mtime and cached["size"] == stat.st_size and len(cached["norms"]) == max_step:
+            return cached["norms"]
+
+    norms = np.empty(max_step)
+    for step in range(max_step):
+        norms[step] = stream_norm(f[f"scores/step_{step}"]["param_update"])
+
+    try:
+        np.savez(cache_file, norms=norms, mtime=stat.st_mtime, size=stat.st_size)
+    except OSError:
+        print(f"Warning: could not write the norm cache '{cache_file}'.")
+    return norms
+
+@timed
+def load_cifar10_images(root):
+    # Training images straight from the CIFAR-10 python batch files, decoded once into a uint8
+    # (N, 32, 32, 3) .npy cache that is memory mapped, so only the rows that are used get read
+    batch_dir = os.path.join(root, "cifar-10-batches-py")
+    cache_file = os.path.join(batch_dir, "train_images.npy")
+    if os.path.isfile(cache_file):
+        # A cache that cannot be read or does not hold the full training set is rebuilt
+        try:
+            images = np.load(cache_file, mmap_mode="r")
+            if images.shape == CIFAR10_TRAIN_SHAPE and images.dtype == np.uint8:
+                return images
+        except (OSError, ValueError):
+            pass
+        print(f"Warning: rebuilding the invalid image cache '{cache_file}'.")
+
+    batches = []
+    for i in range(1, 6):
+        with open(os.path.join(batch_dir, f"data_batch_{i}"), "rb") as fo:
+            batch = pickle.load(fo, encoding="bytes")
+        batches.append(batch[b"data"].reshape(-1, 3, 32, 32).transpose(0, 2, 3, 1))
+    images = np.ascontiguousarray(np.concatenate(batches), dtype=np.uint8)
+
+    # Written under a unique name and moved into place, so a concurrent reader or an interrupted
+    # write never leaves a partial cache behind
+    tmp = None
+    try:
+        fd, tmp = tempfile.mkstemp(dir=batch_dir, suffix=".npy.tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, images)
+        os.replace(tmp, cache_file)
+    except OSError:
+        print(f"Warning: could not write the image cache '{cache_file}'.")
+        if tmp is not None and os.path.exists(tmp):
+            os.remove(tmp)
+        return images
+    return np.load(cache_file, mmap_mode="r")
+
+def mnist_to_base64(image_array):
+    image_array = np.squeeze(image_array, axis=0)  # Remove channel dim -> (28, 28)
+
+    # Normalize to range [0, 1] for colormap
+    image_array = (image_array - image_array.min()) / (image_array.max() - image_array.min())
+
+    # Apply colormap
+    colored_image = cm.gray(image_array)  # Get RGBA values
+
+    # Convert to uint8 and remove alpha channel
+    img = Image.fromarray((colored_image[..., :3] * 255).astype(np.uint8))  # Use RGB only
+
+    buffered = BytesIO()
+    img.save(buffered, format="PNG")
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+def cifar10_to_base64(image_array):
+    # Ensure image is (H, W, 3)
+    if image_array.shape[0] == 3:  # (3, 32, 32) → (32, 32, 3)
+        image_array = image_array.transpose(1, 2, 0)
+
+    # Normalize to [0, 255] and convert to uint8
+    image_array = ((image_array - image_array.min()) / (image_array.max() - image_array.min()) * 255).astype(np.uint8)
+
+    # Convert NumPy array to PIL Image
+    img = Image.fromarray(image_array)  # Now it correctly handles RGB
+
+    # Encode to base64
+    buffered = BytesIO()
+    img.save(buffered, format="PNG")
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+def image_to_base64(image_array):
+    # Ensure image is (H, W, 3)
+    if image_array.shape[0] == 3:  # (3, 32, 32) → (32, 32, 3)
+        image_array = image_array.transpose(1, 2, 0)
+
+    # Normalize to [0, 255] and convert to uint8, raw pixels are used as they are
+    if image_array.dtype != np.uint8:
+        image_array = ((image_array - image_array.min()) / (image_array.max() - image_array.min()) * 255).astype(np.uint8)
+
+    # Convert NumPy array to PIL Image
+    img = Image.fromarray(image_array)  # Now it correctly handles RGB
+
+    # Encode to base64
+    buffered = BytesIO()
+    img.save(buffered, format="PNG")
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+@timed
+def encode_images(images, dataset):
+    # Thumbnails for the given images in their order, as used by the img columns
+    if dataset == 'MNIST':
+        return [mnist_to_base64(img) for img in images]
+    elif dataset == 'CIFAR10':
+        return [cifar10_to_base64(img) for img in images]
+
+def generate_noise_barchart(noise_values, width=150, height=100, dpi=100):
+    # Create a bar chart from the noise values
+    fig, ax = plt.subplots(figsize=(width/100, height/100), dpi=dpi)
+    ax.bar(range(len(noise_values)), noise_values, color='gray')
+    # Remove ticks and labels for a clean image
+    ax.set_xticks(range(len(noise_values)))
+    ax.set_xticklabels([f"{i}" for i in range(len(noise_values))], fontsize=8)
+
+    ax.set_yticks([])
+    plt.tight_layout()
+
+    # Save the figure to a bytes buffer and encode as base64
+    buf = BytesIO()
+    plt.savefig(buf, format="png", bbox_inches='tight')
+    buf.flush()
+    plt.close(fig)
+    buf.seek(0)
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+def normalize_induced_noise(all_induced_noises):
+    # Convert noise values to absolute (as higher absolute noise means higher confidence) and
+    # normalize so each row (datapoint) sums to 1, for every epoch at once
+    abs_noises = np.abs(all_induced_noises)
+    row_sums = abs_noises.sum(axis=2, keepdims=True)
+    row_sums[row_sums == 0] = 1  # Avoid division by zero
+    return abs_noises / row_sums  # Shape: (epochs, num_datapoints, num_classes)
+
+def noise_order(all_noise):
+    # Sort data based on noise, descending (ties keep the reverse index order the tuple sort used)
+    return np.argsort(all_noise, kind="stable")[::-1]
+
+def epoch_ranks(all_epoch_noises):
+    # Rank of every point within its epoch, highest noise first: one batched argsort, then the
+    # inverse permutation is scattered back
+    n_epochs, n_points = all_epoch_noises.shape
+    all_epoch_indices = np.argsort(all_epoch_noises, axis=1)[:, ::-1]
+    relative_positioning = np.empty_like(all_epoch_indices)
+    np.put_along_axis(relative_positioning, all_epoch_indices, np.broadcast_to(np.arange(n_points), (n_epochs, n_points)), axis=1)
+    return relative_positioning
+
+@timed
+def read_mpe_server(h5_file):
+    with h5py.File(h5_file, "r") as f:
+        scores_group = f["scores"]
+        X = np.array(scores_group["X_train"], dtype=np.float32)
+        y = np.array(scores_group["y_train"], dtype=np.int64)
+        estimated_deviation = np.array(scores_group["sensitivities"], dtype=np.float64)
+        true_deviation = np.array(scores_group["softmax_deviations"], dtype=np.float64)
+        bpe = np.array(scores_group["bpe"], dtype=np.float32)
+        bls = np.array(scores_group["bls"], dtype=np.float32)
+        config = read_config(f)
+
+    return X, y, estimated_deviation, true_deviation, bpe, bls, config
+
+@timed
+def read_evolving_server(h5_file, tolerance=0):
+    with h5py.File(h5_file, "r") as f:
+        config = read_config(f)
+        total_steps = config.get("total_step")
+        log_step = config.get("log_step")
+        total_batch = config.get("total_batch")
+
+        # Read X_train and y_train from coord
+        X_train = f["coord"]["X_train"][:]
+        y_train = f["coord"]["y_train"][:]
+        ids = list(range(len(X_train)))
+
+        # Extract data from scores group
+        bpe_scores = [f[f"scores/step_{step}"]["bpe"][()] for step in range(total_steps)]
+        bls_scores = [f[f"scores/step_{step}"]["bls"][()] for step in range(total_steps)]
+        softmax_deviation = [f[f"scores/step_{step}"]["softmax_deviations"][()] for step in range(total_steps)]
+        sensitivity_scores = [f[f"scores/step_{step}"]["sensitivities"][:] for step in range(total_steps)]
+
+        # Extract boundary for each step
+        xs, ys = extract_boundaries(f, [f"scores/step_{step}" for step in range(total_steps)], tolerance)
+
+    return total_steps, log_step, total_batch, X_train, y_train, ids, bpe_scores, bls_scores, softmax_deviation, sensitivity_scores, xs, ys
+
+@timed
+def read_var_exp(h5_file, tolerance=0):
+    with h5py.File(h5_file, "r") as f:
+        config = read_config(f)
+        total_steps = config.get("total_step")
+        log_step = config.get("log_step")
+        total_batch = config.get("total_batch")
+
+        # Read X_train and y_train from coord
+        X_train = f["coord"]["X_train"][:]
+        y_train = f["coord"]["y_train"][:]
+        ids = list(range(len(X_train)))
+
+        # Extract data from scores group
+        bpe_scores = [f[f"scores/step_{step}"]["bpe"][()] for step in range(total_steps)]
+        bls_scores = [f[f"scores/step_{step}"]["bls"][()] for step in range(total_steps)]
+        softmax_deviation = [f[f"scores/step_{step}"]["softmax_deviations"][()] for step in range(total_steps)]
+        marginal_vars = [f[f"scores/step_{step}"]["average_marginal"][()] for step in range(total_steps)]
+        lambdas = [f[f"scores/step_{step}"]["average_lambda"][()] for step in range(total_steps)]
+        Z = [f[f"scores/step_{step}"]["decision_boundary"]["Z"][:] for step in range(total_steps)]
+        sensitivity_scores = [f[f"scores/step_{step}"]["sensitivities"][:] for step in range(total_steps)]
+
+        # Extract boundary for each step
+        xs, ys = extract_boundaries(f, [f"scores/step_{step}" for step in range(total_steps)], tolerance)
+
+    return total_steps, log_step, total_batch, X_train, y_train, ids, bpe_scores, bls_scores, softmax_deviation, marginal_vars, lambdas, Z, sensitivity_scores, xs, ys
+
+@timed
+def read_ls_server(h5_file, tolerance=0):
+    with h5py.File(h5_file, "r") as f:
+        config = read_config(f)
+        max_epoch = config.get("max_epochs")
+
+        X_coord = np.array(f["coord/X_train"])
+        y_train = np.array(f["coord/y_train"])
+
+        all_epoch_noises = [f[f"scores/epoch_{epoch}"]["noise"][()] for epoch in range(max_epoch)]
+
+        xs, ys = extract_boundaries(f, [f"scores/epoch_{epoch}" for epoch in range(max_epoch)], tolerance)
+
+    return max_epoch, X_coord, y_train, all_epoch_noises, xs, ys
+
+@timed
+def read_ls_step_server(h5_file, tolerance=0):
+    with h5py.File(h5_file, "r") as f:
+        config = read_config(f)
+        max_epoch = config.get("max_epochs")
+        total_batches = config.get("total_batch")
+        max_step = total_batches * max_epoch
+
+        X_coord = np.array(f["coord/X_train"])
+        y_train = np.array(f["coord/y_train"])
+
+        all_epoch_noises = [f[f"scores/step_{step}"]["noise"][()] for step in range(max_step)]
+
+        xs, ys = extract_boundaries(f, [f"scores/step_{step}" for step in range(max_step)], tolerance)
+
+    return max_step, total_batches, X_coord, y_train, all_epoch_noises, xs, ys
+
+@timed
+def read_sigmoid_projection(h5_file, tolerance=0):
+    with h5py.File(h5_file, "r") as f:
+        config = read_config(f)
+        max_epoch = config.get("max_epochs")
+        total_batches = config.get("total_batch")
+        max_step = total_batches * max_epoch
+
+        X_coord = np.array(f["coord/X_train"])
+        y_train = np.array(f["coord/y_train"])
+
+        all_epoch_noises = [f[f"scores/step_{step}"]["noise"][()] for step in range(max_step)]
+        logits = [f[f"scores/step_{step}"]["logits"][()] for step in range(max_step)]
+        sig_in = [f[f"scores/step_{step}"]["sig_input"][()] for step in range(max_step)]
+
+        xs, ys = extract_boundaries(f, [f"scores/step_{step}" for step in range(max_step)], tolerance)
+
+    return max_step, total_batches, X_coord, y_train, all_epoch_noises, logits, sig_in, xs, ys
+
+@timed
+def read_influence_server(h5_file, tolerance=0):
+    with h5py.File(h5_file, "r") as f:
+        config = read_config(f)
+        max_epoch = config.get("max_epochs")
+        total_batches = config.get("total_batch")
+        max_step = total_batches * max_epoch
+
+        X_coord = np.array(f["coord/X_train"])
+        y_train = np.array(f["coord/y_train"])
+
+        step_update = load_update_norms(f, h5_file, max_step)
+
+        # Only the boundary at the end of each epoch is drawn
+        boundary_steps = [step for step in range(max_step) if ((step+1) % total_batches == 0 and step>0) or step == max_step-1]
+        xs, ys = extract_boundaries(f, [f"scores/step_{step}" for step in boundary_steps], tolerance)
+
+    # One row of step norms per epoch
+    param_update = step_update.reshape(max_epoch, total_batches)
+
+    return max_epoch, max_step, total_batches, X_coord, y_train, param_update, xs, ys
+
+@timed
+def read_label_server(h5_file):
+    with h5py.File(h5_file, "r") as f:
+        all_noise = np.array(f["noise"])  # Load noise values
+        images = np.array(f["images"])  # MNIST images
+        labels = np.array(f["labels"])  # Corresponding labels
+        bpe = np.array(f['bpe'])
+        bls = np.array(f['bls'])
+        dataset = read_config(f).get("dataset")
+
+    return all_noise, images, labels, bpe, bls, dataset
+
+@timed
+def read_image_mm_server(h5_file):
+    with h5py.File(h5_file, "r") as f:
+        config = read_config(f)
+        dataset = config.get("dataset")
+        max_epoch = config.get("max_epochs")
+
+        images = np.array(f["images"])
+        labels = np.array(f["labels"])
+
+        bpe_scores = [f[f"scores/epoch_{epoch}"]["bpe"][()] for epoch in range(max_epoch)]
+        bls_scores = [f[f"scores/epoch_{epoch}"]["bls"][()] for epoch in range(max_epoch)]
+        all_epoch_noises = [f[f"scores/epoch_{epoch}"]["noise"][()] for epoch in range(max_epoch)]
+
+    return dataset, max_epoch, images, labels, bpe_scores, bls_scores, all_epoch_noises
+
+@timed
+def read_label_noise_epoch(h5_file):
+    with h5py.File(h5_file, "r") as f:
+        config = read_config(f)
+        dataset = config.get("dataset")
+        max_epoch = config.get("max_epochs")
+
+        images = np.array(f["images"])
+        labels = np.array(f["labels"])
+
+        # Stacked as (epochs, N) and (epochs, N, C)
+        all_epoch_noises = np.stack([f[f"scores/epoch_{epoch}"]["noise"][()] for epoch in range(max_epoch)])
+        all_induced_noises = np.stack([f[f"scores/epoch_{epoch}"]["all_noise"][()] for epoch in range(max_epoch)])
+
+        test_nll = [float(f[f"results/epoch_{epoch}"]["test_nll"][()].item()) for epoch in range(max_epoch)]
+        estimated_nll = [f[f"results/epoch_{epoch}"]["estimated_nll"][()] for epoch in range(max_epoch)]
+
+    return dataset, max_epoch, images, labels, all_epoch_noises, all_induced_noises, test_nll, estimated_nll
+
+@timed
+def read_cifar_server(npz_file):
+    data = np.load(npz_file)
+
+    all_noise = data["label_noise_all"]  # Load noise values
+    all_noise = np.array([np.linalg.norm(x,2) for x in all_noise])
+
+    labels = np.array([CIFAR10_CLASSES[int(label)] for label in data["labels_all"]]) # Corresponding labels
+
+    return all_noise, labels
+
+READERS = {
+    "mpe_server": read_mpe_server,
+    "evolving_server": read_evolving_server,
+    "var_exp": read_var_exp,
+    "ls_server": read_ls_server,
+    "ls_step_server": read_ls_step_server,
+    "sigmoid_projection": read_sigmoid_projection,
+    "influence_server": read_influence_server,
+    "label_server": read_label_server,
+    "image_mm_server": read_image_mm_server,
+    "label_noise_epoch": read_label_noise_epoch,
+    "cifar_server": read_cifar_server,
+}
@@ -1,9 +1,12 @@
 from bokeh.plotting import figure
 from bokeh.layouts import column
 import numpy as np
+from visualizer.profiling import timed
 
 class SensitivityVisualizer:
-    def __init__(self, shared_source):
+    @timed
+    def __init__(self, shared_source, webgl=False):
+        self.webgl = webgl
         self.source = shared_source
         self.plot = self.create_plot()
 
@@ -12,7 +15,7 @@ class SensitivityVisualizer:
         p = figure(title="Sensitivity Visualization",
                    width=600, height=600,
                    tools='tap,box_select,box_zoom,reset,pan',
-                   active_drag='box_select')
+                   active_drag='box_select', output_backend="webgl" if self.webgl else "canvas")
         p.xaxis.axis_label = 'True Deviation'
         p.yaxis.axis_label = 'Estimated Deviation'
 
@@ -0,0 +1,137 @@
+import os
+import sys
+import threading
+from collections import OrderedDict
+from bokeh.plotting import curdoc
+from visualizer.bundle import is_bundle, manifest_path, read_stage
+from visualizer.profiling import timed, phase
+
+class RunCache:
+    def __init__(self, size=8):
+        self.size = size
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, name, path, loader, *args):
+        # Keyed on the file's mtime and size as well, so a rewritten run is read again
+        stat = os.stat(path)
+        key = (name, os.path.realpath(path), stat.st_mtime_ns, stat.st_size, args)
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+        value = loader(path, *args)
+        if self.size > 0:
+            with self.lock:
+                self.entries[key] = value
+                while len(self.entries) > self.size:
+                    self.entries.popitem(last=False)
+        return value
+
+_cache = None
+_data_dir = None
+_url_args = False
+
+# Options naming files to write, directories to read besides --file or process-wide resources are
+# never taken from the URL
+COMMAND_LINE_ONLY = ("output", "cifar_root", "train_workers", "train_threads", "profile_log", "message_log", "telemetry_log")
+
+# Options whose cost for the server or the browser grows with their value are bounded, (low, high),
+# when taken from the URL
+URL_LIMITS = {
+    "n_sample": (1, 5000),
+    "lod_budget": (100, 20000),
+    "raster_bins": (16, 512),
+    "raster_threshold": (0, 20000),
+    "warm_epochs": (1, 50),
+    "cache_size": (0, 64),
+    "telemetry_interval": (500, 60000),
+}
+
+def configure(cache_size=8, data_dir=None):
+    # Called once by serve.py before any session is created
+    global _cache, _data_dir, _url_args
+    _cache = RunCache(size=cache_size)
+    _data_dir = os.path.realpath(data_dir) if data_dir is not None else None
+    _url_args = True
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        _cache = RunCache()
+    return _cache
+
+@timed
+def load_run(name, path, loader, *args):
+    # Loaded values are shared by every session reading the same file and must not be modified in place.
+    # A bundle written by prepare.py holds the loader's result already
+    if is_bundle(path):
+        return get_cache().get(name, manifest_path(path), lambda manifest: read_stage(path, name, "run"))
+    return get_cache().get(name, path, loader, *args)
+
+@timed
+def load_derived(name, path, compute, *key):
+    # Values computed from a run rather than read from it, e.g. a model trained on its points, cached on the
+    # run's file like load_run; key holds everything else the value depends on
+    if is_bundle(path):
+        path = manifest_path(path)
+    return get_cache().get(name, path, lambda path, *key: compute(), *key)
+
+def load_stage(name, path, stage):
+    # Other artifacts of a bundle, None when path is not a bundle or was prepared without the stage
+    if not is_bundle(path):
+        return None
+    with phase(f"load_stage {stage}"):
+        return get_cache().get(f"{name}:{stage}", manifest_path(path), lambda manifest: read_stage(path, name, stage))
+
+def url_options(parser):
+    # Actions of the options a session URL may set, by option name without the dashes
+    options = {}
+    for action in parser._actions:
+        if action.dest == "help" or action.dest in COMMAND_LINE_ONLY:
+            continue
+        for option in action.option_strings:
+            if option.startswith("--"):
+                options[option[2:]] = action
+    return options
+
+def session_args(parser):
+    argv = sys.argv[1:]
+
+    # Under serve.py the query arguments of the session URL are appended as command line options,
+    # e.g. ?file=run.h5&webgl=1 gives --file run.h5 --webgl and ?webgl=0 gives --no-webgl
+    context = curdoc().session_context
+    from_url = set()
+    if _url_args and context is not None and context.request is not None:
+        options = url_options(parser)
+        for key, values in context.request.arguments.items():
+            action = options.get(key)
+            if action is None:
+                continue
+            from_url.add(action.dest)
+            for value in values:
+                value = value.decode("utf-8")
+                if action.nargs != 0:
+                    argv += [f"--{key}", value]
+                elif value.lower() in ("0", "false", "no", "off"):
+                    if f"no-{key}" in options:
+                        argv.append(f"--no-{key}")
+                else:
+                    argv.append(f"--{key}")
+
+    args = parser.parse_args(argv)
+
+    for dest in sorted(from_url & URL_LIMITS.keys()):
+        low, high = URL_LIMITS[dest]
+        value = getattr(args, dest)
+        if value is not None and not low <= value <= high:
+            parser.error(f"--{dest} must be between {low} and {high} when given in the URL")
+
+    if _data_dir is not None and getattr(args, "file", None) is not None:
+        path = os.path.realpath(os.path.join(_data_dir, args.file))
+        if os.path.commonpath([_data_dir, path]) != _data_dir:
+            parser.error(f"--file must be inside {_data_dir}")
+        args.file = path
+
+    return args
@@ -0,0 +1,118 @@
+import json
+import time
+from bokeh.models import ColumnDataSource, CustomJS
+
+# Every CustomJS body is run inside this wrapper. Timings are buffered on the telemetry source and sent
+# to the server in one property change per interval, "frame" is the time until the frame after the
+# callback has been drawn.
+WRAPPER = """
+var _telemetry_start = performance.now();
+try {
+%s
+} finally {
+    (function(name) {
+        function push(kind) {
+            var buffer = _telemetry._buffer || (_telemetry._buffer = {"name": [], "kind": [], "ms": []});
+            buffer["name"].push(name);
+            buffer["kind"].push(kind);
+            buffer["ms"].push(performance.now() - _telemetry_start);
+            if (!_telemetry._timer) {
+                _telemetry._timer = setTimeout(function() {
+                    var batch = _telemetry._buffer;
+                    _telemetry._buffer = null;
+                    _telemetry._timer = null;
+                    _telemetry.data = batch;
+                }, _telemetry_interval);
+            }
+        }
+        push("callback");
+        requestAnimationFrame(function() {
+            requestAnimationFrame(function() { push("frame"); });
+        });
+    })(%s);
+}
+"""
+
+class Telemetry:
+    def __init__(self, name, interval=2000, log_file=None):
+        self.name = name
+        self.interval = interval
+        self.log_file = log_file
+        self.stats = {}
+        self.source = ColumnDataSource(data={"name": [], "kind": [], "ms": []})
+        self.source.on_change("data", self.receive)
+
+    def owner_label(self, model):
+        for attr in ("title", "label", "name"):
+            value = getattr(model, attr, None)
+            if isinstance(value, str) and value:
+                return f"{type(model).__name__}[{value}]"
+        css_classes = getattr(model, "css_classes", None)
+        if css_classes:
+            return f"{type(model).__name__}[{css_classes[0]}]"
+        return type(model).__name__
+
+    def callback_names(self, doc):
+        # Named after the model and event they are attached to, or the argument name they are executed
+        # through by another callback
+        names = {}
+        for model in doc.models:
+            events = [(event.replace("change:", ""), callbacks) for event, callbacks in model.js_property_callbacks.items()]
+            events += list(model.js_event_callbacks.items())
+            for event, callbacks in events:
+                for callback in callbacks:
+                    if isinstance(callback, CustomJS):
+                        names.setdefault(callback, f"{self.owner_label(model)}.{event}")
+        for model in doc.models:
+            if isinstance(model, CustomJS):
+                for key, value in model.args.items():
+                    if isinstance(value, CustomJS):
+                        names.setdefault(value, key)
+
+        unique, seen = {}, {}
+        for callback, name in names.items():
+            seen[name] = seen.get(name, 0) + 1
+            unique[callback] = name if seen[name] == 1 else f"{name}#{seen[name]}"
+        return unique
+
+    def wrap(self, doc):
+        for callback, name in self.callback_names(doc).items():
+            # Already wrapped, or an ES module whose body cannot be wrapped
+            if "_telemetry" in callback.args or "export default" in callback.code:
+                continue
+            callback.args = dict(callback.args, _telemetry=self.source, _telemetry_interval=self.interval)
+            callback.code = WRAPPER % (callback.code, json.dumps(name))
+
+    def receive(self, attr, old, new):
+        batch = list(zip(new["name"], new["kind"], new["ms"]))
+        for name, kind, ms in batch:
+            count, total, slowest = self.stats.get((name, kind), (0, 0.0, 0.0))
+            self.stats[(name, kind)] = (count + 1, total + ms, max(slowest, ms))
+
+        if self.log_file is not None:
+            now = time.time()
+            with open(self.log_file, "a") as fo:
+                for name, kind, ms in batch:
+                    fo.write(json.dumps({"app": self.name, "time": now, "name": name, "kind": kind, "ms": ms}) + "\n")
+
+        # Totals so far of the callbacks in this batch, slowest first
+        for key in sorted({(name, kind) for name, kind, _ in batch}, key=lambda key: -self.stats[key][1]):
+            count, total, slowest = self.stats[key]
+            print(f"Telemetry of {self.name}: {key[0]} {key[1]}: {count} calls, {total / count:.1f} ms mean, {slowest:.1f} ms max")
+
+def add_telemetry_args(parser):
+    parser.add_argument("--telemetry", action="store_true", help="Time every browser callback and the frame drawn after it, and log the times per callback on the server")
+    parser.add_argument("--no-telemetry", dest="telemetry", action="store_false", help="Run the browser callbacks without timing them")
+    parser.add_argument("--telemetry_interval", type=int, default=2000, help="Milliseconds between two batches of browser timings sent to the server, 2000 by default")
+    parser.add_argument("--telemetry_log", type=str, default=None, help="If specified with --telemetry, append one JSON record per browser timing to this file")
+
+def attach_telemetry(doc, name, args):
+    # Only under a Bokeh server, a saved HTML file has nowhere to send the timings
+    if not args.telemetry:
+        return None
+    if doc.session_context is None:
+        print("Warning: --telemetry needs a Bokeh server, the callbacks are not timed.")
+        return None
+    telemetry = Telemetry(name, interval=args.telemetry_interval, log_file=args.telemetry_log)
+    telemetry.wrap(doc)
+    return telemetry
@@ -3,8 +3,11 @@ from bokeh.layouts import column, row
 import numpy as np
 import matplotlib
 from bokeh.plotting import figure
+from visualizer.playback import PlaybackScheduler
+from visualizer.profiling import timed
 
 class TestNLLAnimation:
+    @timed
     def __init__(self, shared_source, shared_resource, max_epoch, subsample_intermediate, subsample_source, default_color='blue'):
         self.source = shared_source
         self.shared_resource = shared_resource
@@ -14,17 +17,17 @@ class TestNLLAnimation:
         self.subsample_intermediate = subsample_intermediate
         self.subsample_source = subsample_source
 
-        initial_epoch = 0
-        initial_index = shared_resource.data["epoch"].index(initial_epoch) if initial_epoch in shared_resource.data["epoch"] else None
+        # Number of rows with epoch <= s for every slider value s, so the NLL curve
+        # for any epoch is a single prefix slice of the full series
+        epochs = np.asarray(shared_resource.data["epoch"])
+        self.visible_counts = np.searchsorted(epochs, np.arange(self.max_epoch + 1), side="right").tolist()
 
-        if initial_index is not None:
-            self.data_stream = ColumnDataSource(data={
-                'epoch': [shared_resource.data["epoch"][initial_index]],
-                'test_nll': [shared_resource.data["test_nll"][initial_index]],
-                'estimated_nll': [shared_resource.data["estimated_nll"][initial_index]]
-            })
-        else:
-            self.data_stream = ColumnDataSource(data={'epoch': [], 'test_nll': [], 'estimated_nll': []})
+        initial_count = self.visible_counts[0]
+        self.data_stream = ColumnDataSource(data={
+            'epoch': list(shared_resource.data["epoch"][:initial_count]),
+            'test_nll': list(shared_resource.data["test_nll"][:initial_count]),
+            'estimated_nll': list(shared_resource.data["estimated_nll"][:initial_count])
+        })
 
         self.step_slider = Slider(start=0, end=self.max_epoch, value=0, step=1, title="Epoch")
         self.play_button = Button(label="Play", button_type="success")
@@ -74,79 +77,42 @@ class TestNLLAnimation:
 
         self.clear_button = Button(label="Clear", button_type="warning")
 
+        self.playback = PlaybackScheduler(self.step_slider, self.play_button, speed=2)
+
         self.setup_callbacks()
 
     def setup_callbacks(self):
         self.step_slider.js_on_change("value", CustomJS(args={"source": self.data_stream,
                                                               "original": self.shared_resource,
                                                               "intermediate": self.source,
+                                                              "visible_counts": self.visible_counts,
                                                               "subsample_intermediate": self.subsample_intermediate,
                                                               "subsample_source": self.subsample_source},
         code="""
             var step = cb_obj.value;
             var shared_data = original.data;
-            var current_epochs = source.data["epoch"];
-            
-            if (current_epochs.length > 0) {
-                var prev_max = Math.max(...current_epochs);
-                
-                if (step > prev_max) {
-                    for (var s = prev_max + 1; s <= step; s++) {
-                        var step_index = shared_data["epoch"].indexOf(s);
-                        if (step_index !== -1) {
-                            source.data["epoch"].push(shared_data["epoch"][step_index]);
-                            source.data["test_nll"].push(shared_data["test_nll"][step_index]);
-                            source.data["estimated_nll"].push(shared_data["estimated_nll"][step_index]);
-                        }
-                    }
-                } else if (step < prev_max) {
-                    while (source.data["epoch"].length > 0 && Math.max(...source.data["epoch"]) > step) {
-                        source.data["epoch"].pop();
-                        source.data["test_nll"].pop();
-                        source.data["estimated_nll"].pop();
-                    }
-                }
-            } else {
-                var step_index = shared_data["epoch"].indexOf(step);
-                if (step_index !== -1) {
-                    source.data["epoch"].push(shared_data["epoch"][step_index]);
-                    source.data["test_nll"].push(shared_data["test_nll"][step_index]);
-                    source.data["estimated_nll"].push(shared_data["estimated_nll"][step_index]);
-                }
-            }
-            intermediate.data["y"] = shared_data["y"][step];
-            intermediate.data["x"] = shared_data["x"][step];
-            intermediate.data["noise_chart"] = shared_data["noise_chart"][step];
+            var n = visible_counts[step];
 
-            for (let i = 0; i < subsample_intermediate.length; i++) {
-                subsample_intermediate[i].data = subsample_source[step][i].data;  // Update bar chart data
-                subsample_intermediate[i].change.emit();
-                console.log("Step: ", step);
+            // Prefix of the full series up to the current epoch, mutated in place so
+            // nothing is synced back to the server
+            source.data["epoch"] = shared_data["epoch"].slice(0, n);
+            source.data["test_nll"] = shared_data["test_nll"].slice(0, n);
+            source.data["estimated_nll"] = shared_data["estimated_nll"].slice(0, n);
+            source.change.emit();
+
+            if (n === 0) {
+                return;
             }
+            var step_index = n - 1;
 
+            intermediate.data["y"] = shared_data["y"][step_index];
+            intermediate.data["x"] = shared_data["x"][step_index];
+            intermediate.data["noise_chart"] = shared_data["noise_chart"][step_index];
             intermediate.change.emit();
-            source.change.emit();
-        """))
 
-        self.play_button.js_on_event("button_click", CustomJS(args={"slider": self.step_slider,
-                                                                     "button": self.play_button,
-                                                                     "max_epoch": self.max_epoch},
-        code="""
-            if (button.label === "Play") {
-                button.label = "Pause";
-                var step = slider.value;
-                var interval = setInterval(function() {
-                    if (slider.value < max_epoch && button.label === "Pause") {
-                        slider.value += 1;
-                    } else {
-                        clearInterval(interval);
-                        button.label = "Play";
-                    }
-                }, 500);
-                button.interval = interval;
-            } else {
-                clearInterval(button.interval);
-                button.label = "Play";
+            for (let i = 0; i < subsample_intermediate.length; i++) {
+                subsample_intermediate[i].data["values"] = subsample_source[step_index][i].data["values"];  // Update bar chart data
+                subsample_intermediate[i].change.emit();
             }
         """))
 
@@ -173,5 +139,6 @@ class TestNLLAnimation:
         return column(
             self.plot, 
             row(Spacer(width=30), self.step_slider, self.play_button, self.clear_button),
+            row(Spacer(width=30), self.playback.get_layout()),
             row(Spacer(width=30), Div(text="Tracker Colors:"), *self.tracker_buttons)
         )
\ No newline at end of file
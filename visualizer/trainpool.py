@@ -0,0 +1,107 @@
+import multiprocessing
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+
+def pin_threads(threads):
+    import torch
+    torch.set_num_threads(threads)
+    torch.set_num_interop_threads(1)
+
+class TrainingPool:
+    def __init__(self, workers=1, threads=1):
+        self.workers = workers
+
+        # Spawned rather than forked, the server process has already started torch's thread pools
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=pin_threads, initargs=(threads,))
+
+        # Jobs wait here instead of in the executor so they can be coalesced and report their
+        # position; at most `workers` jobs are handed to the executor at once
+        self.lock = threading.RLock()
+        self.queue = OrderedDict()
+        self.running = 0
+
+    def submit(self, key, fn, *args, on_position=None):
+        future = Future()
+        with self.lock:
+            # A newer request from the same session takes over the queued one's place in line
+            previous = self.queue.get(key)
+            self.queue[key] = (future, fn, args, on_position)
+            if previous is not None:
+                previous[0].cancel()
+        future.add_done_callback(partial(self.discard, key))
+        self.dispatch()
+        return future
+
+    def discard(self, key, future):
+        with self.lock:
+            if key in self.queue and self.queue[key][0] is future:
+                del self.queue[key]
+        self.report()
+
+    def dispatch(self):
+        started, failed = [], []
+        with self.lock:
+            while self.running < self.workers and self.queue:
+                key, (future, fn, args, on_position) = self.queue.popitem(last=False)
+                if not future.set_running_or_notify_cancel():
+                    continue
+                # Counted only once the executor took the job, a job it refused must not hold a slot
+                try:
+                    job = self.executor.submit(fn, *args)
+                except Exception as error:
+                    failed.append((future, error))
+                    continue
+                self.running += 1
+                job.add_done_callback(partial(self.finish, future))
+                started.append(on_position)
+        for future, error in failed:
+            future.set_exception(error)
+        for on_position in started:
+            self.notify(on_position, 0)
+        self.report()
+
+    def report(self):
+        with self.lock:
+            waiting = [on_position for future, fn, args, on_position in self.queue.values()]
+        for position, on_position in enumerate(waiting, 1):
+            self.notify(on_position, position)
+
+    def notify(self, on_position, position):
+        # Called outside the lock; a failing callback, e.g. of a session whose document is already
+        # gone, must not stop the queue or reach the other sessions
+        if on_position is None:
+            return
+        try:
+            on_position(position)
+        except Exception as error:
+            print(f"Training pool: position callback failed ({error!r})")
+
+    def remove(self, key):
+        # Drops the queued job of a closed session, a running one finishes and its result is ignored
+        with self.lock:
+            entry = self.queue.pop(key, None)
+        if entry is not None:
+            entry[0].cancel()
+        self.report()
+
+    def finish(self, future, job):
+        with self.lock:
+            self.running -= 1
+        error = job.exception()
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(job.result())
+        self.dispatch()
+
+_pool = None
+
+def get_pool(workers=1, threads=1):
+    # Shared by every session of the server, the module is imported once per process
+    global _pool
+    if _pool is None:
+        _pool = TrainingPool(workers=workers, threads=threads)
+    return _pool
@@ -1,9 +1,12 @@
 from bokeh.plotting import figure
 from bokeh.layouts import column
 from bokeh.models import HoverTool
+from visualizer.profiling import timed
 
 class VarianceLambdaPlot:
-    def __init__(self, shared_source):
+    @timed
+    def __init__(self, shared_source, webgl=False):
+        self.webgl = webgl
         self.shared_source = shared_source
         self.plot = self.create_plot()
 
@@ -19,7 +22,7 @@ class VarianceLambdaPlot:
         p = figure(title="Variance vs Lambda Plot",
                    width=600, height=600,
                    tools='tap,box_select, box_zoom, reset',
-                   active_drag='box_select')
+                   active_drag='box_select', output_backend="webgl" if self.webgl else "canvas")
         p.xaxis.axis_label = 'Marginal Variance'
         p.yaxis.axis_label = 'Lambda'
 